@@ -0,0 +1,51 @@
+"""chatroom message counters
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('chatrooms', sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('chatrooms', sa.Column('last_message_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('chatrooms', sa.Column('last_message_preview', sa.String(length=120), nullable=True))
+
+    # Backfill counters from existing messages
+    op.execute("""
+        UPDATE chatrooms AS c
+        SET message_count = s.message_count,
+            last_message_at = s.last_message_at
+        FROM (
+            SELECT chatroom_id, COUNT(*) AS message_count, MAX(created_at) AS last_message_at
+            FROM messages
+            GROUP BY chatroom_id
+        ) AS s
+        WHERE c.id = s.chatroom_id
+    """)
+    op.execute("""
+        UPDATE chatrooms AS c
+        SET last_message_preview = LEFT(m.content, 120)
+        FROM (
+            SELECT DISTINCT ON (chatroom_id) chatroom_id, content
+            FROM messages
+            ORDER BY chatroom_id, created_at DESC, id DESC
+        ) AS m
+        WHERE c.id = m.chatroom_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('chatrooms', 'last_message_preview')
+    op.drop_column('chatrooms', 'last_message_at')
+    op.drop_column('chatrooms', 'message_count')
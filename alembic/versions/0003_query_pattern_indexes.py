@@ -0,0 +1,61 @@
+"""query pattern indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built concurrently so existing tables stay writable during the migration
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_chatroom_id_created_at', 'messages',
+            ['chatroom_id', 'created_at', 'id'], unique=False,
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_chatrooms_user_id_updated_at', 'chatrooms',
+            ['user_id', 'updated_at'], unique=False,
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_otps_mobile_number_purpose_is_used', 'otps',
+            ['mobile_number', 'purpose', 'is_used'], unique=False,
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_subscriptions_user_id_status', 'subscriptions',
+            ['user_id', 'status'], unique=False,
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            op.f('ix_users_stripe_customer_id'), 'users',
+            ['stripe_customer_id'], unique=False,
+            postgresql_concurrently=True
+        )
+        # Superseded by the composite OTP index (same leading column)
+        op.drop_index('ix_otps_mobile_number', table_name='otps', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_otps_mobile_number', 'otps', ['mobile_number'], unique=False,
+            postgresql_concurrently=True
+        )
+        op.drop_index(op.f('ix_users_stripe_customer_id'), table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_subscriptions_user_id_status', table_name='subscriptions', postgresql_concurrently=True)
+        op.drop_index('ix_otps_mobile_number_purpose_is_used', table_name='otps', postgresql_concurrently=True)
+        op.drop_index('ix_chatrooms_user_id_updated_at', table_name='chatrooms', postgresql_concurrently=True)
+        op.drop_index('ix_messages_chatroom_id_created_at', table_name='messages', postgresql_concurrently=True)
@@ -1,11 +1,17 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from contextlib import asynccontextmanager
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager, suppress
+import asyncio
 import uvicorn
 from app.config import settings
-from app.database import engine, Base
+from app.database import async_engine
+from app.utils.cache import init_redis_pool, close_redis_pool, tiered_cache_stats
+from app.utils.pubsub import pubsub_hub, watch_cache_invalidations
+from app.utils.token_revocation import watch_revocations
 from app.routers import auth_router, user_router, chatroom_router, subscription_router, webhook_router
+from app.services.gemini_limiter import gemini_limiter
+from app.services.response_cache import response_cache
 
 
 @asynccontextmanager
@@ -13,14 +19,31 @@ async def lifespan(app: FastAPI):
     # Startup
     print("Starting up Gemini Backend Clone...")
     
-    # Create database tables
-    Base.metadata.create_all(bind=engine)
-    print("Database tables created successfully")
+    # Database schema is managed by Alembic (`alembic upgrade head`)
+    
+    # Open the shared Redis connection pool
+    await init_redis_pool()
+    
+    # Mirror revoked tokens locally so auth checks need no Redis round trip
+    revocation_watcher = asyncio.create_task(watch_revocations())
+    
+    # Keep in-process caches coherent with writes made by other processes
+    invalidation_watcher = asyncio.create_task(watch_cache_invalidations())
     
     yield
     
     # Shutdown
     print("Shutting down Gemini Backend Clone...")
+    
+    for watcher in (revocation_watcher, invalidation_watcher):
+        watcher.cancel()
+        with suppress(asyncio.CancelledError):
+            await watcher
+    
+    # Close the shared pub/sub subscriber, pooled Redis and async database connections
+    await pubsub_hub.stop()
+    await close_redis_pool()
+    await async_engine.dispose()
 
 
 # Create FastAPI app
@@ -28,7 +51,8 @@ app = FastAPI(
     title="Gemini Backend Clone",
     description="A Gemini-style backend system with OTP authentication, chatrooms, and AI conversations",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -68,10 +92,20 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Cache hit/miss and Gemini limiter metrics"""
+    return {
+        "gemini_response_cache": await response_cache.stats(),
+        "tiered_caches": tiered_cache_stats(),
+        "gemini_limiter": await gemini_limiter.stats()
+    }
+
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Custom HTTP exception handler"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "success": False,
@@ -84,7 +118,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     """General exception handler"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "success": False,
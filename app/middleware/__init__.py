@@ -1,5 +1,5 @@
-from .auth import get_current_user
-from .rate_limit import check_rate_limit
+from .auth import authenticate_token, get_current_user
+from .rate_limit import check_rate_limit, refund_rate_limit
 
-__all__ = ["get_current_user", "check_rate_limit"]
+__all__ = ["authenticate_token", "get_current_user", "check_rate_limit", "refund_rate_limit"]
 
@@ -1,39 +1,61 @@
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.models.user import User
-from app.utils.auth import verify_token
+from app.schemas import UserPrincipal
+from app.utils.auth import verify_token_async
+from app.utils.cache import cache_user_principal, get_cached_user_principal, get_user_principal_version
 
 # Security scheme
 security = HTTPBearer()
 
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get current authenticated user from JWT token"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
+async def authenticate_token(token: str, db: AsyncSession) -> Optional[UserPrincipal]:
+    """Resolve a JWT to its user's principal, or None if the token or user is invalid"""
     # Verify token
-    payload = verify_token(credentials.credentials)
+    payload = await verify_token_async(token)
     if payload is None:
-        raise credentials_exception
+        return None
     
     # Get user ID from token
-    user_id: int = payload.get("sub")
-    if user_id is None:
-        raise credentials_exception
+    try:
+        user_id = int(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+    
+    # Get user from principal cache, falling back to the database
+    principal = await get_cached_user_principal(user_id)
+    if principal is not None:
+        return principal
     
-    # Get user from database
-    user = db.query(User).filter(User.id == user_id).first()
+    # Read before the database so an invalidation during the read wins
+    version = await get_user_principal_version(user_id)
+    user = await db.get(User, user_id)
     if user is None:
-        raise credentials_exception
+        return None
+    principal = UserPrincipal.model_validate(user)
+    await cache_user_principal(principal, version)
+    return principal
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> UserPrincipal:
+    """Get the current authenticated user from the JWT token.
+
+    The principal is a read-only snapshot; endpoints that modify the user
+    load it with `db.get(User, current_user.id)`.
+    """
+    user = await authenticate_token(credentials.credentials, db)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
     if not user.is_active:
         raise HTTPException(
@@ -42,4 +64,3 @@ async def get_current_user(
         )
     
     return user
-
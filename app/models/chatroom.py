@@ -1,16 +1,26 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, update
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
 
+# Length of the denormalized last message preview
+PREVIEW_LENGTH = 120
+
 
 class Chatroom(Base):
     __tablename__ = "chatrooms"
+    __table_args__ = (
+        # Chatroom list ordered by most recent activity
+        Index("ix_chatrooms_user_id_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     title = Column(String(255), nullable=False)
     description = Column(Text)
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_at = Column(DateTime(timezone=True))
+    last_message_preview = Column(String(PREVIEW_LENGTH))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -18,6 +28,27 @@ class Chatroom(Base):
     user = relationship("User", back_populates="chatrooms")
     messages = relationship("Message", back_populates="chatroom", cascade="all, delete-orphan")
 
+    @classmethod
+    def record_message(cls, chatroom_id: int, content: str):
+        """UPDATE statement that bumps the denormalized message counters.
+
+        Executed in the same transaction as the message insert so the
+        counters stay in step with the messages table.
+        """
+        return update(cls).where(cls.id == chatroom_id).values(
+            message_count=cls.message_count + 1,
+            last_message_at=func.now(),
+            last_message_preview=content[:PREVIEW_LENGTH],
+            updated_at=func.now()
+        ).execution_options(synchronize_session=False)
+
+    @classmethod
+    def list_columns(cls):
+        """Owner plus the columns of a chatroom list entry, for RETURNING clauses"""
+        return (
+            cls.id, cls.user_id, cls.title, cls.description, cls.created_at, cls.updated_at,
+            cls.message_count, cls.last_message_at, cls.last_message_preview
+        )
+
     def __repr__(self):
         return f"<Chatroom(id={self.id}, title={self.title}, user_id={self.user_id})>"
-
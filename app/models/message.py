@@ -1,11 +1,21 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, insert, literal, select, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
+from app.models.chatroom import Chatroom
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Chatroom history pages and worker context (keyset on created_at, id)
+        Index("ix_messages_chatroom_id_created_at", "chatroom_id", "created_at", "id"),
+        # One reply per task, so a redelivered task cannot save a second one
+        Index(
+            "ix_messages_gemini_response_id", "gemini_response_id",
+            unique=True, postgresql_where=text("gemini_response_id IS NOT NULL")
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     chatroom_id = Column(Integer, ForeignKey("chatrooms.id", ondelete="CASCADE"), nullable=False)
@@ -17,6 +27,29 @@ class Message(Base):
     # Relationships
     chatroom = relationship("Chatroom", back_populates="messages")
 
+    @classmethod
+    def insert_for_owner(cls, chatroom_id: int, user_id: int, content: str, role: str = "user"):
+        """Single-statement INSERT that also bumps the chatroom counters.
+
+        The chatroom UPDATE runs in a CTE restricted to the owning user, so
+        no row is inserted (and nothing is returned) when the chatroom does
+        not exist or belongs to someone else. The row returned holds the
+        new message's `message_id` and `message_created_at` plus the
+        updated chatroom's list columns (`Chatroom.list_columns`).
+        """
+        room = Chatroom.record_message(chatroom_id, content).where(
+            Chatroom.user_id == user_id
+        ).returning(*Chatroom.list_columns()).cte("room")
+        message = insert(cls).from_select(
+            ["chatroom_id", "content", "role"],
+            select(room.c.id, literal(content), literal(role))
+        ).returning(cls.id, cls.created_at).cte("message")
+        return select(
+            message.c.id.label("message_id"),
+            message.c.created_at.label("message_created_at"),
+            *room.c
+        )
+
     def __repr__(self):
         return f"<Message(id={self.id}, chatroom_id={self.chatroom_id}, role={self.role})>"
 
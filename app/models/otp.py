@@ -1,13 +1,17 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from app.database import Base
 
 
 class OTP(Base):
     __tablename__ = "otps"
+    __table_args__ = (
+        # OTP verification lookup
+        Index("ix_otps_mobile_number_purpose_is_used", "mobile_number", "purpose", "is_used"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    mobile_number = Column(String(15), nullable=False, index=True)
+    mobile_number = Column(String(15), nullable=False)
     otp_code = Column(String(6), nullable=False)
     purpose = Column(String(20), nullable=False)  # 'login', 'signup', 'reset'
     expires_at = Column(DateTime(timezone=True), nullable=False)
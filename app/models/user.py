@@ -15,7 +15,7 @@ class User(Base):
     subscription_tier = Column(String(20), default="basic")
     daily_message_count = Column(Integer, default=0)
     last_message_date = Column(Date)
-    stripe_customer_id = Column(String(255))
+    stripe_customer_id = Column(String(255), index=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
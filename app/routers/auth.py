@@ -1,26 +1,36 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from app.database import get_db
+from app.database import get_async_db
 from app.models.user import User
-from app.models.otp import OTP
 from app.schemas import (
     UserSignup, SendOTP, VerifyOTP, ChangePassword,
-    TokenResponse, OTPResponse, SuccessResponse, UserResponse
+    TokenResponse, OTPResponse, SuccessResponse, UserResponse, UserPrincipal
 )
-from app.utils.auth import create_access_token, get_password_hash, verify_password
-from app.utils.otp import generate_otp, get_otp_expiry, is_otp_valid
-from app.middleware.auth import get_current_user
+from app.utils.auth import create_access_token, get_password_hash_async, verify_password_async, verify_token
+from app.utils.cache import invalidate_user_principal
+from app.utils.token_revocation import revoke_token
+from app.middleware.auth import get_current_user, security
+from app.services.otp_store import EXPIRED, INVALID, TOO_MANY_ATTEMPTS, VALID, otp_store
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+OTP_ERRORS = {
+    INVALID: "Invalid OTP",
+    EXPIRED: "OTP has expired",
+    TOO_MANY_ATTEMPTS: "Too many OTP attempts; request a new code",
+}
+
 
 @router.post("/signup", response_model=SuccessResponse)
-async def signup(user_data: UserSignup, db: Session = Depends(get_db)):
+async def signup(user_data: UserSignup, db: AsyncSession = Depends(get_async_db)):
     """Register a new user with mobile number"""
     
     # Check if user already exists
-    existing_user = db.query(User).filter(User.mobile_number == user_data.mobile_number).first()
+    result = await db.execute(select(User).where(User.mobile_number == user_data.mobile_number))
+    existing_user = result.scalars().first()
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -32,12 +42,12 @@ async def signup(user_data: UserSignup, db: Session = Depends(get_db)):
         mobile_number=user_data.mobile_number,
         name=user_data.name,
         email=user_data.email,
-        password_hash=get_password_hash(user_data.password) if user_data.password else None
+        password_hash=await get_password_hash_async(user_data.password) if user_data.password else None
     )
     
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     return SuccessResponse(
         message="User registered successfully",
@@ -46,31 +56,20 @@ async def signup(user_data: UserSignup, db: Session = Depends(get_db)):
 
 
 @router.post("/send-otp", response_model=OTPResponse)
-async def send_otp(otp_request: SendOTP, db: Session = Depends(get_db)):
+async def send_otp(otp_request: SendOTP, db: AsyncSession = Depends(get_async_db)):
     """Send OTP to user's mobile number (mocked)"""
     
     # Check if user exists
-    user = db.query(User).filter(User.mobile_number == otp_request.mobile_number).first()
+    result = await db.execute(select(User).where(User.mobile_number == otp_request.mobile_number))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    # Generate OTP
-    otp_code = generate_otp()
-    expires_at = get_otp_expiry()
-    
-    # Save OTP to database
-    otp = OTP(
-        mobile_number=otp_request.mobile_number,
-        otp_code=otp_code,
-        purpose="login",
-        expires_at=expires_at
-    )
-    
-    db.add(otp)
-    db.commit()
+    # Generate and store OTP
+    otp_code = await otp_store.issue(db, otp_request.mobile_number, "login")
     
     # In production, send OTP via SMS service
     # For now, return OTP in response (development only)
@@ -81,36 +80,20 @@ async def send_otp(otp_request: SendOTP, db: Session = Depends(get_db)):
 
 
 @router.post("/verify-otp", response_model=TokenResponse)
-async def verify_otp(otp_data: VerifyOTP, db: Session = Depends(get_db)):
+async def verify_otp(otp_data: VerifyOTP, db: AsyncSession = Depends(get_async_db)):
     """Verify OTP and return JWT token"""
     
-    # Find valid OTP
-    otp = db.query(OTP).filter(
-        OTP.mobile_number == otp_data.mobile_number,
-        OTP.otp_code == otp_data.otp_code,
-        OTP.purpose == "login",
-        OTP.is_used == False
-    ).first()
-    
-    if not otp:
+    # Check and consume OTP (single use)
+    otp_status = await otp_store.consume(db, otp_data.mobile_number, "login", otp_data.otp_code)
+    if otp_status != VALID:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid OTP"
+            detail=OTP_ERRORS[otp_status]
         )
     
-    # Check if OTP is expired
-    if not is_otp_valid(otp.expires_at):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="OTP has expired"
-        )
-    
-    # Mark OTP as used
-    otp.is_used = True
-    db.commit()
-    
     # Get user
-    user = db.query(User).filter(User.mobile_number == otp_data.mobile_number).first()
+    result = await db.execute(select(User).where(User.mobile_number == otp_data.mobile_number))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -127,31 +110,20 @@ async def verify_otp(otp_data: VerifyOTP, db: Session = Depends(get_db)):
 
 
 @router.post("/forgot-password", response_model=OTPResponse)
-async def forgot_password(otp_request: SendOTP, db: Session = Depends(get_db)):
+async def forgot_password(otp_request: SendOTP, db: AsyncSession = Depends(get_async_db)):
     """Send OTP for password reset"""
     
     # Check if user exists
-    user = db.query(User).filter(User.mobile_number == otp_request.mobile_number).first()
+    result = await db.execute(select(User).where(User.mobile_number == otp_request.mobile_number))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    # Generate OTP
-    otp_code = generate_otp()
-    expires_at = get_otp_expiry()
-    
-    # Save OTP to database
-    otp = OTP(
-        mobile_number=otp_request.mobile_number,
-        otp_code=otp_code,
-        purpose="reset",
-        expires_at=expires_at
-    )
-    
-    db.add(otp)
-    db.commit()
+    # Generate and store OTP
+    otp_code = await otp_store.issue(db, otp_request.mobile_number, "reset")
     
     return OTPResponse(
         message="Password reset OTP sent successfully",
@@ -162,21 +134,40 @@ async def forgot_password(otp_request: SendOTP, db: Session = Depends(get_db)):
 @router.post("/change-password", response_model=SuccessResponse)
 async def change_password(
     password_data: ChangePassword,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Change user password while logged in"""
     
+    # Load the user itself: the principal holds no credentials and is read-only
+    user = await db.get(User, current_user.id)
+    
     # Verify current password
-    if not current_user.password_hash or not verify_password(password_data.current_password, current_user.password_hash):
+    if not user.password_hash or not await verify_password_async(
+        password_data.current_password, user.password_hash
+    ):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
     
     # Update password
-    current_user.password_hash = get_password_hash(password_data.new_password)
-    db.commit()
+    user.password_hash = await get_password_hash_async(password_data.new_password)
+    await db.commit()
+    await invalidate_user_principal(user.id)
     
     return SuccessResponse(message="Password changed successfully")
 
+
+
+@router.post("/logout", response_model=SuccessResponse)
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """Revoke the access token used for this request"""
+    
+    payload = verify_token(credentials.credentials)
+    await revoke_token(credentials.credentials, float(payload["exp"]))
+    
+    return SuccessResponse(message="Logged out successfully")
@@ -1,28 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
-from app.database import get_db
-from app.models.user import User
+import asyncio
+import json
+import logging
+from uuid import uuid4
+from fastapi import (
+    APIRouter, Depends, HTTPException, Query, status, BackgroundTasks, WebSocket, WebSocketDisconnect
+)
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from pydantic import TypeAdapter
+from app.database import AsyncSessionLocal, get_async_db
 from app.models.chatroom import Chatroom
 from app.models.message import Message
 from app.schemas import (
     ChatroomCreate, ChatroomResponse, ChatroomDetail,
-    MessageCreate, MessageResponse, SuccessResponse
+    MessageCreate, MessageResponse, SuccessResponse, TaskStatusResponse, UserPrincipal
 )
-from app.middleware.auth import get_current_user
-from app.middleware.rate_limit import check_rate_limit, increment_message_count
-from app.utils.cache import cache_user_chatrooms, get_cached_chatrooms, invalidate_chatroom_cache
+from app.middleware.auth import authenticate_token, get_current_user
+from app.middleware.rate_limit import check_rate_limit, refund_rate_limit
+from app.config import settings
+from app.utils.cache import cache_user_chatrooms, get_cached_chatrooms, get_redis_client, update_cached_chatroom
+from app.utils.coalesce import queue_pending_message
+from app.utils.context_buffer import append_context_message
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.pubsub import chatroom_channel, pubsub_hub
+from app.utils.task_status import QUEUED, get_task_status, set_task_status
 from app.services.tasks import process_gemini_message
+from app.services.celery_app import gemini_task_options
+from app.services.chat_reply import announce_reply, cache_chatroom, load_context, save_reply
+from app.services.gemini_service import gemini_service
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chatroom", tags=["Chatroom"])
 
+# Serializes chatroom lists straight to JSON bytes in one pass
+chatroom_list_adapter = TypeAdapter(List[ChatroomResponse])
+
+
+async def _best_effort(step: str, awaitable) -> bool:
+    """Await a Redis side effect of an already committed write, logging instead of failing the request"""
+    try:
+        await awaitable
+        return True
+    except Exception:
+        logger.exception("Could not %s", step)
+        return False
+
 
 @router.post("", response_model=ChatroomResponse)
 async def create_chatroom(
     chatroom_data: ChatroomCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new chatroom for the authenticated user"""
     
@@ -34,69 +65,78 @@ async def create_chatroom(
     )
     
     db.add(chatroom)
-    db.commit()
-    db.refresh(chatroom)
+    await db.commit()
+    await db.refresh(chatroom)
     
-    # Invalidate cache
-    invalidate_chatroom_cache(current_user.id)
+    # Add it to the cached chatroom list
+    chatroom_entry = ChatroomResponse.from_orm(chatroom)
+    await _best_effort("update cached chatroom", update_cached_chatroom(current_user.id, chatroom_entry))
     
-    return ChatroomResponse.from_orm(chatroom)
+    return chatroom_entry
 
 
 @router.get("", response_model=List[ChatroomResponse])
 async def get_user_chatrooms(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List all chatrooms for the user (with caching)"""
     
-    # Try to get from cache first
-    cached_chatrooms = get_cached_chatrooms(current_user.id)
-    if cached_chatrooms:
-        return [ChatroomResponse(**chatroom) for chatroom in cached_chatrooms]
+    # Serve the cached list as is (kept current by every message write)
+    cached_body = await get_cached_chatrooms(current_user.id)
+    if cached_body:
+        return Response(content=cached_body, media_type="application/json")
     
-    # Query database with message count
-    chatrooms_query = db.query(
-        Chatroom,
-        func.count(Message.id).label('message_count')
-    ).outerjoin(Message).filter(
+    # Query database (message counters are denormalized on the chatroom row)
+    chatrooms_query = select(Chatroom).where(
         Chatroom.user_id == current_user.id
-    ).group_by(Chatroom.id).order_by(Chatroom.updated_at.desc())
-    
-    chatrooms_with_count = chatrooms_query.all()
-    
-    # Prepare response data
-    chatrooms_data = []
-    for chatroom, message_count in chatrooms_with_count:
-        chatroom_dict = {
-            "id": chatroom.id,
-            "title": chatroom.title,
-            "description": chatroom.description,
-            "created_at": chatroom.created_at,
-            "updated_at": chatroom.updated_at,
-            "message_count": message_count or 0
-        }
-        chatrooms_data.append(chatroom_dict)
+    ).order_by(Chatroom.updated_at.desc())
+    
+    result = await db.execute(chatrooms_query)
+    chatrooms = result.scalars().all()
     
-    # Cache the results
-    cache_user_chatrooms(current_user.id, chatrooms_data)
+    # Cache the entries and serialize the response once
+    chatroom_entries = chatroom_list_adapter.validate_python(chatrooms, from_attributes=True)
+    await cache_user_chatrooms(current_user.id, chatroom_entries)
     
-    return [ChatroomResponse(**chatroom) for chatroom in chatrooms_data]
+    return Response(content=chatroom_list_adapter.dump_json(chatroom_entries), media_type="application/json")
 
 
 @router.get("/{chatroom_id}", response_model=ChatroomDetail)
 async def get_chatroom_detail(
     chatroom_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="Cursor: return messages older than this position"),
+    after: Optional[str] = Query(None, description="Cursor: return messages newer than this position"),
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get detailed information about a specific chatroom"""
+    """Get a chatroom with a page of its message history.
+
+    Without a cursor the most recent messages are returned. Pass the
+    returned next_cursor as `before` to page back through older history,
+    or a message cursor as `after` to fetch newer messages. Each page is
+    ordered oldest to newest.
+    """
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only one of 'before' or 'after' may be given"
+        )
+    
+    cursor = decode_cursor(before or after) if (before or after) else None
+    if (before or after) and cursor is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
     
     # Get chatroom
-    chatroom = db.query(Chatroom).filter(
+    result = await db.execute(select(Chatroom).where(
         Chatroom.id == chatroom_id,
         Chatroom.user_id == current_user.id
-    ).first()
+    ))
+    chatroom = result.scalars().first()
     
     if not chatroom:
         raise HTTPException(
@@ -104,10 +144,32 @@ async def get_chatroom_detail(
             detail="Chatroom not found"
         )
     
-    # Get messages
-    messages = db.query(Message).filter(
-        Message.chatroom_id == chatroom_id
-    ).order_by(Message.created_at.asc()).all()
+    # Get one page of messages (keyset on created_at, id), plus one row to detect more
+    position = tuple_(Message.created_at, Message.id)
+    messages_query = select(Message).where(Message.chatroom_id == chatroom_id)
+    if after:
+        messages_query = messages_query.where(position > tuple_(*cursor)).order_by(
+            Message.created_at.asc(), Message.id.asc()
+        )
+    else:
+        if before:
+            messages_query = messages_query.where(position < tuple_(*cursor))
+        messages_query = messages_query.order_by(
+            Message.created_at.desc(), Message.id.desc()
+        )
+    
+    result = await db.execute(messages_query.limit(limit + 1))
+    messages = list(result.scalars().all())
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not after:
+        messages.reverse()
+    
+    # Cursor continues in the direction of travel
+    next_cursor = None
+    if has_more and messages:
+        edge = messages[-1] if after else messages[0]
+        next_cursor = encode_cursor(edge.created_at, edge.id)
     
     # Prepare response
     chatroom_detail = ChatroomDetail(
@@ -116,8 +178,12 @@ async def get_chatroom_detail(
         description=chatroom.description,
         created_at=chatroom.created_at,
         updated_at=chatroom.updated_at,
-        message_count=len(messages),
-        messages=[MessageResponse.from_orm(msg) for msg in messages]
+        message_count=chatroom.message_count or 0,
+        last_message_at=chatroom.last_message_at,
+        last_message_preview=chatroom.last_message_preview,
+        messages=[MessageResponse.from_orm(msg) for msg in messages],
+        next_cursor=next_cursor,
+        has_more=has_more
     )
     
     return chatroom_detail
@@ -128,59 +194,273 @@ async def send_message(
     chatroom_id: int,
     message_data: MessageCreate,
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Send a message and receive a Gemini response (via queue/async call)"""
     
-    # Check if chatroom exists and belongs to user
-    chatroom = db.query(Chatroom).filter(
-        Chatroom.id == chatroom_id,
-        Chatroom.user_id == current_user.id
-    ).first()
+    # Check and consume rate limit (Redis, no database work)
+    await check_rate_limit(current_user)
     
-    if not chatroom:
+    # Save user message and bump chatroom counters in one statement and one
+    # commit; the ownership check is part of the statement
+    try:
+        result = await db.execute(Message.insert_for_owner(
+            chatroom_id, current_user.id, message_data.content
+        ))
+        row = result.first()
+        if row is None:
+            await db.rollback()
+        else:
+            await db.commit()
+    except Exception:
+        await refund_rate_limit(current_user)
+        raise
+    
+    if row is None:
+        await refund_rate_limit(current_user)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Chatroom not found"
         )
+    message_id = row.message_id
     
-    # Check rate limits
-    check_rate_limit(current_user, db)
+    # The message is saved: Redis errors from here on must not stop its task being queued
     
-    # Save user message
-    user_message = Message(
-        chatroom_id=chatroom_id,
-        content=message_data.content,
-        role="user"
+    # Add to the worker's context buffer before the task can run
+    await _best_effort(
+        "append to context buffer",
+        append_context_message(chatroom_id, message_id, "user", message_data.content)
     )
     
-    db.add(user_message)
-    db.commit()
-    db.refresh(user_message)
+    # Record the task as queued before the worker can pick it up
+    task_id = str(uuid4())
+    await _best_effort("record task status", set_task_status(
+        task_id, QUEUED, user_id=current_user.id, chatroom_id=chatroom_id, message_id=message_id
+    ))
     
-    # Increment message count
-    increment_message_count(current_user, db)
-    
-    # Queue Gemini API call
-    task = process_gemini_message.delay(
-        chatroom_id=chatroom_id,
-        user_message=message_data.content,
-        message_id=user_message.id
+    # With coalescing, the task runs after the debounce window and answers
+    # every message that arrived in the meantime with one Gemini call;
+    # a message that could not join the batch is answered on its own
+    coalesce = settings.message_coalesce_window > 0 and await _best_effort(
+        "queue pending message",
+        queue_pending_message(chatroom_id, message_id, message_data.content, task_id)
     )
     
-    # Update chatroom timestamp
-    chatroom.updated_at = func.now()
-    db.commit()
+    # Queue Gemini API call on the user's tier queue (after commit so the worker sees the message)
+    try:
+        task = process_gemini_message.apply_async(
+            task_id=task_id,
+            kwargs={
+                "chatroom_id": chatroom_id,
+                "user_message": message_data.content,
+                "message_id": message_id,
+                "bypass_cache": message_data.bypass_cache,
+                "coalesce": coalesce
+            },
+            countdown=settings.message_coalesce_window if coalesce else None,
+            **gemini_task_options(current_user.subscription_tier)
+        )
+    except Exception:
+        await refund_rate_limit(current_user)
+        raise
     
-    # Invalidate cache
-    invalidate_chatroom_cache(current_user.id)
+    # Write the bumped counters through to the cached chatroom list
+    await _best_effort(
+        "update cached chatroom",
+        update_cached_chatroom(current_user.id, ChatroomResponse.model_validate(row))
+    )
     
     return SuccessResponse(
         message="Message sent successfully. AI response is being generated.",
         data={
-            "message_id": user_message.id,
+            "message_id": message_id,
             "task_id": task.id
         }
     )
 
+
+@router.get("/{chatroom_id}/message/{task_id}/status", response_model=TaskStatusResponse)
+async def get_message_status(
+    chatroom_id: int,
+    task_id: str,
+    current_user: UserPrincipal = Depends(get_current_user)
+):
+    """Get the state of the Gemini task queued by send_message.
+
+    Served from a small Redis record kept for `TASK_STATUS_TTL` seconds;
+    no database or result-backend lookup is made.
+    """
+    task_status = await get_task_status(task_id)
+    if (
+        task_status is None
+        or task_status.get("user_id") != str(current_user.id)
+        or task_status.get("chatroom_id") != str(chatroom_id)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Task not found"
+        )
+    
+    return TaskStatusResponse(task_id=task_id, **task_status)
+
+
+# Sent instead of the underlying error, which may expose internals
+STREAM_ERROR = "Could not generate a response. Please try again."
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/{chatroom_id}/message/stream")
+async def stream_message(
+    chatroom_id: int,
+    message_data: MessageCreate,
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Send a message and stream the Gemini response as Server-Sent Events.
+
+    Emits `chunk` events with text deltas as they arrive, then a `done`
+    event carrying the saved assistant message id (or an `error` event).
+    """
+    
+    # Check and consume rate limit (Redis, no database work)
+    await check_rate_limit(current_user)
+    
+    # Save user message and bump chatroom counters in one statement and one
+    # commit; the ownership check is part of the statement
+    try:
+        result = await db.execute(Message.insert_for_owner(
+            chatroom_id, current_user.id, message_data.content
+        ))
+        row = result.first()
+        if row is None:
+            await db.rollback()
+        else:
+            await db.commit()
+    except Exception:
+        await refund_rate_limit(current_user)
+        raise
+    
+    if row is None:
+        await refund_rate_limit(current_user)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chatroom not found"
+        )
+    user_message_id = row.message_id
+    
+    await _best_effort(
+        "append to context buffer",
+        append_context_message(chatroom_id, user_message_id, "user", message_data.content)
+    )
+    await _best_effort(
+        "update cached chatroom",
+        update_cached_chatroom(current_user.id, ChatroomResponse.model_validate(row))
+    )
+    
+    async def event_stream():
+        yield _sse_event("start", {"message_id": user_message_id})
+        
+        chunks = []
+        try:
+            # Recent history and rolling summary (maintained by the worker)
+            redis_client = await get_redis_client()
+            context = await load_context(redis_client, chatroom_id)
+            _, recent_history, summary, covered_until_id = context
+            conversation_history = [msg for msg in recent_history if msg['id'] != user_message_id]
+            
+            async for text in gemini_service.stream_response(
+                message_data.content, conversation_history, summary, covered_until_id,
+                use_cache=not message_data.bypass_cache
+            ):
+                chunks.append(text)
+                yield _sse_event("chunk", {"text": text})
+        except Exception:
+            logger.exception("Streaming a reply for chatroom %s failed", chatroom_id)
+            # No reply was saved: give the message back to the daily limit
+            await _best_effort("refund message quota", refund_rate_limit(current_user))
+            yield _sse_event("error", {"error": STREAM_ERROR})
+            return
+        
+        # Persist the complete assistant reply (request session may already be closed)
+        try:
+            assistant_message, chatroom_row = await save_reply(chatroom_id, "".join(chunks), None)
+        except Exception:
+            logger.exception("Saving a streamed reply for chatroom %s failed", chatroom_id)
+            yield _sse_event("error", {"error": STREAM_ERROR})
+            return
+        
+        await _best_effort(
+            "announce streamed reply",
+            announce_reply(redis_client, chatroom_id, assistant_message, context, [])
+        )
+        await cache_chatroom(chatroom_row)
+        
+        yield _sse_event("done", {"message_id": assistant_message.id})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _wait_for_disconnect(websocket: WebSocket) -> None:
+    """Consume client frames until the socket closes"""
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+
+@router.websocket("/{chatroom_id}/ws")
+async def chatroom_events(
+    websocket: WebSocket,
+    chatroom_id: int,
+    token: Optional[str] = Query(None)
+):
+    """Push new assistant messages for a chatroom as they are saved.
+
+    Authenticate with `?token=<jwt>` (browsers cannot set headers on a
+    WebSocket) or an `Authorization: Bearer` header. Each event is a JSON
+    object `{"type": "message", "chatroom_id": ..., "message": {...}}`.
+    """
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    
+    # Authenticate and check ownership without holding a connection for the socket's lifetime
+    async with AsyncSessionLocal() as db:
+        user = await authenticate_token(token, db) if token else None
+        owned = False
+        if user is not None and user.is_active:
+            result = await db.execute(select(Chatroom.id).where(
+                Chatroom.id == chatroom_id,
+                Chatroom.user_id == user.id
+            ))
+            owned = result.first() is not None
+    
+    if not owned:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    async with pubsub_hub.listen(chatroom_channel(chatroom_id)) as events:
+        disconnected = asyncio.create_task(_wait_for_disconnect(websocket))
+        try:
+            while True:
+                next_event = asyncio.create_task(events.get())
+                await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    next_event.cancel()
+                    break
+                await websocket.send_text(next_event.result())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            disconnected.cancel()
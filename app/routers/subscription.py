@@ -1,27 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.models.user import User
 from app.models.subscription import Subscription
-from app.schemas import SubscriptionResponse, SuccessResponse
+from app.schemas import SubscriptionResponse, SuccessResponse, UserPrincipal
 from app.middleware.auth import get_current_user
 from app.services.stripe_service import stripe_service
+from app.utils.cache import invalidate_user_principal
 
 router = APIRouter(prefix="/subscribe", tags=["Subscription"])
 
 
 @router.post("/pro", response_model=SuccessResponse)
 async def subscribe_to_pro(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Initiate a Pro subscription via Stripe Checkout"""
     
     # Check if user already has an active subscription
-    existing_subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).where(
         Subscription.user_id == current_user.id,
         Subscription.status == "active"
-    ).first()
+    ))
+    existing_subscription = result.scalars().first()
     
     if existing_subscription:
         raise HTTPException(
@@ -29,11 +32,12 @@ async def subscribe_to_pro(
             detail="User already has an active Pro subscription"
         )
     
-    # Create or get Stripe customer
-    if not current_user.stripe_customer_id:
+    # Create or get Stripe customer (the principal may predate a concurrent update)
+    user = await db.get(User, current_user.id)
+    if not user.stripe_customer_id:
         customer_result = stripe_service.create_customer(
-            email=current_user.email or f"{current_user.mobile_number}@example.com",
-            mobile_number=current_user.mobile_number
+            email=user.email or f"{user.mobile_number}@example.com",
+            mobile_number=user.mobile_number
         )
         
         if not customer_result['success']:
@@ -42,15 +46,16 @@ async def subscribe_to_pro(
                 detail=f"Failed to create Stripe customer: {customer_result['error']}"
             )
         
-        current_user.stripe_customer_id = customer_result['customer_id']
-        db.commit()
+        user.stripe_customer_id = customer_result['customer_id']
+        await db.commit()
+        await invalidate_user_principal(user.id)
     
     # Create checkout session
     success_url = "https://your-frontend-domain.com/subscription/success"
     cancel_url = "https://your-frontend-domain.com/subscription/cancel"
     
     session_result = stripe_service.create_checkout_session(
-        customer_id=current_user.stripe_customer_id,
+        customer_id=user.stripe_customer_id,
         success_url=success_url,
         cancel_url=cancel_url
     )
@@ -72,16 +77,17 @@ async def subscribe_to_pro(
 
 @router.get("/status", response_model=SubscriptionResponse)
 async def get_subscription_status(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Check the user's current subscription tier"""
     
     # Get active subscription
-    subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).where(
         Subscription.user_id == current_user.id,
         Subscription.status == "active"
-    ).first()
+    ))
+    subscription = result.scalars().first()
     
     if subscription:
         return SubscriptionResponse(
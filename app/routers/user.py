@@ -1,13 +1,16 @@
 from fastapi import APIRouter, Depends
-from app.models.user import User
-from app.schemas import UserResponse
+from app.schemas import UserPrincipal, UserResponse
 from app.middleware.auth import get_current_user
+from app.utils.quota import get_daily_message_count
 
 router = APIRouter(prefix="/user", tags=["User"])
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: UserPrincipal = Depends(get_current_user)):
     """Get details about the currently authenticated user"""
-    return UserResponse.from_orm(current_user)
+    user_response = UserResponse.from_orm(current_user)
+    # Live counter is kept in Redis; the users table is synced periodically
+    user_response.daily_message_count = await get_daily_message_count(current_user.id)
+    return user_response
 
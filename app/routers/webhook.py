@@ -1,16 +1,19 @@
 from fastapi import APIRouter, Request, HTTPException, status, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from datetime import datetime
-from app.database import get_db
+from app.database import get_async_db
 from app.models.user import User
 from app.models.subscription import Subscription
 from app.services.stripe_service import stripe_service
+from app.utils.cache import invalidate_user_principal
 
 router = APIRouter(prefix="/webhook", tags=["Webhook"])
 
 
 @router.post("/stripe")
-async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Handle Stripe webhook events"""
     
     # Get request body and signature
@@ -50,13 +53,14 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     return {"status": "success"}
 
 
-async def handle_checkout_completed(session, db: Session):
+async def handle_checkout_completed(session, db: AsyncSession):
     """Handle successful checkout session completion"""
     customer_id = session['customer']
     subscription_id = session['subscription']
     
     # Find user by Stripe customer ID
-    user = db.query(User).filter(User.stripe_customer_id == customer_id).first()
+    result = await db.execute(select(User).where(User.stripe_customer_id == customer_id))
+    user = result.scalars().first()
     if not user:
         return
     
@@ -66,9 +70,10 @@ async def handle_checkout_completed(session, db: Session):
         return
     
     # Create or update subscription record
-    subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).where(
         Subscription.stripe_subscription_id == subscription_id
-    ).first()
+    ))
+    subscription = result.scalars().first()
     
     if not subscription:
         subscription = Subscription(
@@ -87,46 +92,55 @@ async def handle_checkout_completed(session, db: Session):
     # Update user subscription tier
     user.subscription_tier = "pro"
     
-    db.commit()
+    await db.commit()
+    await invalidate_user_principal(user.id)
 
 
-async def handle_payment_succeeded(invoice, db: Session):
+async def handle_payment_succeeded(invoice, db: AsyncSession):
     """Handle successful payment"""
     subscription_id = invoice['subscription']
     
     # Update subscription status
-    subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).options(
+        selectinload(Subscription.user)
+    ).where(
         Subscription.stripe_subscription_id == subscription_id
-    ).first()
+    ))
+    subscription = result.scalars().first()
     
     if subscription:
         subscription.status = "active"
         subscription.user.subscription_tier = "pro"
-        db.commit()
+        await db.commit()
+        await invalidate_user_principal(subscription.user_id)
 
 
-async def handle_payment_failed(invoice, db: Session):
+async def handle_payment_failed(invoice, db: AsyncSession):
     """Handle failed payment"""
     subscription_id = invoice['subscription']
     
     # Update subscription status
-    subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).where(
         Subscription.stripe_subscription_id == subscription_id
-    ).first()
+    ))
+    subscription = result.scalars().first()
     
     if subscription:
         subscription.status = "past_due"
-        db.commit()
+        await db.commit()
 
 
-async def handle_subscription_updated(subscription_obj, db: Session):
+async def handle_subscription_updated(subscription_obj, db: AsyncSession):
     """Handle subscription updates"""
     subscription_id = subscription_obj['id']
     
     # Update subscription record
-    subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).options(
+        selectinload(Subscription.user)
+    ).where(
         Subscription.stripe_subscription_id == subscription_id
-    ).first()
+    ))
+    subscription = result.scalars().first()
     
     if subscription:
         subscription.status = subscription_obj['status']
@@ -139,20 +153,25 @@ async def handle_subscription_updated(subscription_obj, db: Session):
         else:
             subscription.user.subscription_tier = "basic"
         
-        db.commit()
+        await db.commit()
+        await invalidate_user_principal(subscription.user_id)
 
 
-async def handle_subscription_deleted(subscription_obj, db: Session):
+async def handle_subscription_deleted(subscription_obj, db: AsyncSession):
     """Handle subscription cancellation"""
     subscription_id = subscription_obj['id']
     
     # Update subscription record
-    subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).options(
+        selectinload(Subscription.user)
+    ).where(
         Subscription.stripe_subscription_id == subscription_id
-    ).first()
+    ))
+    subscription = result.scalars().first()
     
     if subscription:
         subscription.status = "canceled"
         subscription.user.subscription_tier = "basic"
-        db.commit()
+        await db.commit()
+        await invalidate_user_principal(subscription.user_id)
 
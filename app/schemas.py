@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, validator
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 
 
 # Auth Schemas
@@ -39,6 +39,24 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class UserPrincipal(BaseModel):
+    """Cached snapshot of the authenticated user (no credentials)"""
+    id: int
+    mobile_number: str
+    name: Optional[str] = None
+    email: Optional[str] = None
+    subscription_tier: Optional[str] = "basic"
+    daily_message_count: Optional[int] = 0
+    last_message_date: Optional[date] = None
+    stripe_customer_id: Optional[str] = None
+    is_active: Optional[bool] = True
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+        frozen = True
+
+
 # Chatroom Schemas
 class ChatroomCreate(BaseModel):
     title: str = Field(..., min_length=1, max_length=255)
@@ -52,6 +70,8 @@ class ChatroomResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     message_count: Optional[int] = 0
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -59,11 +79,14 @@ class ChatroomResponse(BaseModel):
 
 class ChatroomDetail(ChatroomResponse):
     messages: List['MessageResponse'] = []
+    next_cursor: Optional[str] = None
+    has_more: bool = False
 
 
 # Message Schemas
 class MessageCreate(BaseModel):
     content: str = Field(..., min_length=1)
+    bypass_cache: bool = False  # Skip the Gemini response cache for this message
 
 
 class MessageResponse(BaseModel):
@@ -76,6 +99,19 @@ class MessageResponse(BaseModel):
         from_attributes = True
 
 
+class TaskStatusResponse(BaseModel):
+    task_id: str
+    state: str  # 'queued', 'processing', 'completed', 'failed'
+    chatroom_id: int
+    message_id: int
+    assistant_message_id: Optional[int] = None
+    queued_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    retries: int = 0
+    error: Optional[str] = None
+
+
 # Subscription Schemas
 class SubscriptionResponse(BaseModel):
     tier: str
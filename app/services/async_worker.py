@@ -0,0 +1,341 @@
+"""Asyncio worker for Gemini tasks.
+
+Consumes the same `process_gemini_message` task messages as the Celery
+workers, but runs many of them concurrently inside one event loop using
+the async database engine, async Redis and the SDK's native async API.
+A prefork Celery worker holds a whole process per in-flight Gemini call;
+this worker keeps up to `--concurrency` calls in flight per process.
+
+Kombu channels are not thread-safe, so all broker I/O (polling and acks)
+happens on one dedicated thread; messages are handed to the event loop
+and acknowledged once their job has finished (late ack), so a crashed
+worker's unacknowledged messages are redelivered.
+
+Usage:
+    python -m app.services.async_worker --queues gemini.pro,gemini.basic --concurrency 200
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from kombu import Consumer
+from kombu.exceptions import OperationalError
+
+from app.config import settings
+from app.database import async_engine
+from app.services.celery_app import GEMINI_BASIC_QUEUE, GEMINI_PRO_QUEUE, celery_app
+from app.services.chat_reply import announce_reply, cache_chatroom, load_context, save_reply
+from app.services.context_builder import context_builder
+from app.services.gemini_limiter import GeminiUnavailable, retry_delay
+from app.services.gemini_service import GeminiService
+from app.utils.cache import close_redis_pool, get_redis_client, init_redis_pool
+from app.utils.coalesce import (
+    acquire_chatroom_lock, is_latest_task, merge_pending_messages, pop_pending_messages,
+    release_chatroom_lock, restore_pending_messages
+)
+from app.utils.task_status import COMPLETED, FAILED, PROCESSING, QUEUED, get_task_status, set_task_status
+
+logger = logging.getLogger(__name__)
+
+TASK_NAME = "app.services.tasks.process_gemini_message"
+
+# How long a broker poll blocks; bounds ack latency and shutdown time
+POLL_TIMEOUT = 1.0
+
+# Pause between attempts to reconnect to the broker
+RECONNECT_DELAY = 2.0
+
+
+class AsyncGeminiWorker:
+    """Runs `process_gemini_message` jobs concurrently on one event loop"""
+
+    def __init__(self, queues: List[str], concurrency: int = None):
+        self.queue_names = queues
+        self.concurrency = concurrency or settings.async_worker_concurrency
+        # Gemini calls are bounded by the in-flight limit rather than the API-side default
+        self.gemini = GeminiService(max_concurrency=self.concurrency)
+        # Single thread owning the broker connection
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broker")
+        self._jobs = set()
+        self._stopping = False
+
+    async def process_message(
+        self,
+        task_id: str,
+        chatroom_id: int,
+        user_message: str,
+        message_id: int,
+        bypass_cache: bool = False,
+        coalesce: bool = False,
+        gemini_retries: int = 0
+    ) -> Dict:
+        """Async equivalent of the `process_gemini_message` Celery task.
+
+        Raises GeminiUnavailable, with the batch restored and statuses back
+        to queued, when the task should be re-queued.
+        """
+        # Messages are acked late, so a task may be redelivered after its reply was saved
+        task_status = await get_task_status(task_id)
+        if task_status and task_status.get("state") == COMPLETED:
+            return {'status': 'completed', 'message_id': task_status.get("assistant_message_id")}
+
+        redis_client = await get_redis_client()
+        task_ids = [task_id]
+        message_ids = [message_id]
+        pending = None
+        lock_token = None
+        try:
+            if coalesce:
+                # Wait for the previous reply to finish; a newer message's task takes over meanwhile
+                while True:
+                    if not await is_latest_task(redis_client, chatroom_id, task_id):
+                        return {'status': 'coalesced'}
+                    lock_token = await acquire_chatroom_lock(redis_client, chatroom_id)
+                    if lock_token is not None:
+                        break
+                    await asyncio.sleep(settings.message_coalesce_window)
+                pending = await pop_pending_messages(redis_client, chatroom_id)
+                if not pending:
+                    # Already answered as part of an earlier batch
+                    return {'status': 'coalesced'}
+                user_message, message_ids, task_ids = merge_pending_messages(pending)
+
+            return await self._generate_reply(
+                redis_client, task_id, chatroom_id, user_message, message_ids, task_ids, bypass_cache
+            )
+        except Exception as e:
+            if isinstance(e, GeminiUnavailable) and gemini_retries < settings.gemini_max_retries:
+                # Gemini is throttling or down: back off and retry rather than saving an error reply
+                if pending:
+                    await restore_pending_messages(redis_client, chatroom_id, pending)
+                for pending_id in task_ids:
+                    await set_task_status(pending_id, QUEUED, retries=gemini_retries + 1)
+                raise
+            for failed_id in task_ids:
+                task_status = await get_task_status(failed_id)
+                if not task_status or task_status.get("state") != COMPLETED:
+                    await set_task_status(failed_id, FAILED, error=e)
+            raise
+        finally:
+            if lock_token is not None:
+                await release_chatroom_lock(redis_client, chatroom_id, lock_token)
+
+    async def _generate_reply(
+        self,
+        redis_client,
+        task_id: str,
+        chatroom_id: int,
+        user_message: str,
+        message_ids: List[int],
+        task_ids: List[str],
+        bypass_cache: bool
+    ) -> Dict:
+        """Generate, save and announce one reply covering `message_ids`"""
+        for pending_id in task_ids:
+            await set_task_status(pending_id, PROCESSING)
+
+        context = await load_context(redis_client, chatroom_id)
+        _, recent_history, summary, covered_until_id = context
+
+        # Prepare conversation history (the new message is sent separately)
+        conversation_history = [msg for msg in recent_history if msg['id'] not in message_ids]
+
+        # No database connection is held while waiting on Gemini
+        gemini_response = await self.gemini.generate_response(
+            user_message,
+            conversation_history,
+            summary,
+            covered_until_id,
+            use_cache=not bypass_cache
+        )
+
+        # Save Gemini response to database
+        assistant_message, chatroom_row = await save_reply(chatroom_id, gemini_response, task_id)
+
+        # Update the context buffer, push the reply to WebSocket clients and complete the tasks
+        await announce_reply(
+            redis_client, chatroom_id, assistant_message, context, task_ids, duplicate=chatroom_row is None
+        )
+        await cache_chatroom(chatroom_row)
+
+        # Fold messages that fell out of the window into the rolling summary
+        await context_builder.refresh_summary_async(
+            redis_client,
+            chatroom_id,
+            user_message,
+            conversation_history,
+            summary,
+            covered_until_id,
+            self.gemini.summarize
+        )
+
+        return {
+            'status': 'completed',
+            'message_id': assistant_message.id
+        }
+
+    async def _run_job(self, message) -> None:
+        """Execute one task message and ack it; status goes to the task status record"""
+        loop = asyncio.get_running_loop()
+        task_id = message.headers.get('id')
+        try:
+            # Honour countdown/eta (used by coalescing) while holding an in-flight slot
+            eta = message.headers.get('eta')
+            if eta:
+                eta = datetime.fromisoformat(eta)
+                if eta.tzinfo is None:
+                    eta = eta.replace(tzinfo=timezone.utc)
+                delay = (eta - datetime.now(timezone.utc)).total_seconds()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            args, kwargs, _ = message.decode()
+            # Same retry budget as the Celery task: only Gemini outages count
+            gemini_retries = kwargs.get('gemini_retries', 0)
+            try:
+                await self.process_message(task_id, *args, **kwargs)
+            except GeminiUnavailable as e:
+                if gemini_retries >= settings.gemini_max_retries:
+                    raise
+                await self._requeue(
+                    message, task_id, args, {**kwargs, 'gemini_retries': gemini_retries + 1},
+                    retry_delay(e, gemini_retries)
+                )
+        except Exception:
+            logger.exception("Task %s failed", task_id)
+        finally:
+            try:
+                await loop.run_in_executor(self._io, message.ack)
+            except Exception:
+                # Delivered on a connection that has since dropped; the broker redelivers
+                # it, and the rerun is skipped once the task is completed
+                logger.warning("Could not acknowledge task %s", task_id, exc_info=True)
+
+    async def _requeue(self, message, task_id: str, args, kwargs, countdown: float) -> None:
+        """Publish the task again with a delay, keeping its id, queue and priority"""
+        logger.warning("Gemini unavailable; retrying task %s in %.1fs", task_id, countdown)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(
+            celery_app.send_task,
+            TASK_NAME,
+            args=args,
+            kwargs=kwargs,
+            task_id=task_id,
+            countdown=countdown,
+            queue=message.delivery_info.get('routing_key'),
+            priority=message.properties.get('priority')
+        ))
+
+    def _on_message(self, loop: asyncio.AbstractEventLoop, body, message) -> None:
+        """Broker-thread callback: hand the message over to the event loop"""
+        if message.headers.get('task') != TASK_NAME:
+            logger.error("Rejecting unsupported task %s", message.headers.get('task'))
+            message.reject(requeue=False)
+            return
+        loop.call_soon_threadsafe(self._start_job, message)
+
+    def _start_job(self, message) -> None:
+        job = asyncio.ensure_future(self._run_job(message))
+        self._jobs.add(job)
+        job.add_done_callback(self._jobs.discard)
+
+    def _drain(self, connection) -> None:
+        try:
+            connection.drain_events(timeout=POLL_TIMEOUT)
+        except socket.timeout:
+            pass
+
+    def stop(self) -> None:
+        """Stop fetching new messages; in-flight jobs are allowed to finish"""
+        self._stopping = True
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        await init_redis_pool()
+        queues = [celery_app.amqp.queues[name] for name in self.queue_names]
+        connection = celery_app.connection_for_read()
+        consumer = None
+        try:
+            consumer = await loop.run_in_executor(self._io, self._start_consumer, loop, connection, queues)
+            logger.info(
+                "Async Gemini worker consuming %s with %d in flight",
+                ", ".join(self.queue_names), self.concurrency
+            )
+            while not self._stopping:
+                try:
+                    if consumer is None:
+                        consumer = await loop.run_in_executor(
+                            self._io, self._reconnect, loop, connection, queues
+                        )
+                    await loop.run_in_executor(self._io, self._drain, connection)
+                except (OperationalError,) + connection.connection_errors:
+                    logger.exception("Broker connection lost; reconnecting in %.1fs", RECONNECT_DELAY)
+                    # The broker redelivers unacknowledged messages; in-flight jobs still finish
+                    await loop.run_in_executor(self._io, connection.collect)
+                    consumer = None
+                    await asyncio.sleep(RECONNECT_DELAY)
+
+            # Warm shutdown: finish what was already fetched
+            if consumer is not None:
+                await loop.run_in_executor(self._io, consumer.cancel)
+            if self._jobs:
+                logger.info("Waiting for %d in-flight tasks", len(self._jobs))
+                await asyncio.gather(*self._jobs, return_exceptions=True)
+        finally:
+            # Anything still unacknowledged is restored to its queue on close
+            await loop.run_in_executor(self._io, connection.release)
+            self._io.shutdown(wait=True)
+            await close_redis_pool()
+            await async_engine.dispose()
+
+    def _reconnect(self, loop: asyncio.AbstractEventLoop, connection, queues) -> Consumer:
+        """One reconnection attempt (so a stop request is not blocked by a broker outage)"""
+        connection.ensure_connection(max_retries=1)
+        consumer = self._start_consumer(loop, connection, queues)
+        logger.info("Reconnected to the broker")
+        return consumer
+
+    def _start_consumer(self, loop: asyncio.AbstractEventLoop, connection, queues) -> Consumer:
+        consumer = Consumer(
+            connection.default_channel,
+            queues=queues,
+            callbacks=[lambda body, message: self._on_message(loop, body, message)],
+            accept=['json']
+        )
+        # The broker never delivers more unacked messages than the in-flight limit
+        consumer.qos(prefetch_count=self.concurrency)
+        consumer.consume()
+        return consumer
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--queues",
+        default=f"{GEMINI_PRO_QUEUE},{GEMINI_BASIC_QUEUE}",
+        help="Comma-separated queues to consume, in priority order"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=settings.async_worker_concurrency,
+        help="Maximum number of tasks in flight"
+    )
+    parser.add_argument("--loglevel", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.loglevel.upper(), format="[%(asctime)s: %(levelname)s/%(name)s] %(message)s")
+    worker = AsyncGeminiWorker([name.strip() for name in args.queues.split(",") if name.strip()], args.concurrency)
+    asyncio.run(worker.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from celery import Celery
+from kombu import Exchange, Queue
 from app.config import settings
 
 # Create Celery app
@@ -9,6 +10,12 @@ celery_app = Celery(
     include=['app.services.tasks']
 )
 
+# Queues: Gemini work is split by subscription tier so a backlog of basic
+# users never delays pro users; periodic housekeeping gets its own queue
+GEMINI_PRO_QUEUE = 'gemini.pro'
+GEMINI_BASIC_QUEUE = 'gemini.basic'
+MAINTENANCE_QUEUE = 'maintenance'
+
 # Celery configuration
 celery_app.conf.update(
     task_serializer='json',
@@ -21,5 +28,43 @@ celery_app.conf.update(
     task_soft_time_limit=25 * 60,  # 25 minutes
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=1000,
+    task_queues=tuple(
+        Queue(name, Exchange(name), routing_key=name)
+        for name in (GEMINI_PRO_QUEUE, GEMINI_BASIC_QUEUE, MAINTENANCE_QUEUE)
+    ),
+    task_default_queue=GEMINI_BASIC_QUEUE,
+    task_routes={
+        'app.services.tasks.process_gemini_message': {'queue': GEMINI_BASIC_QUEUE},
+        'app.services.tasks.sync_daily_message_counts': {'queue': MAINTENANCE_QUEUE},
+        'app.services.tasks.cleanup_expired_otps': {'queue': MAINTENANCE_QUEUE},
+    },
+    # Redis transport priorities: 0 is the highest, 9 the lowest
+    task_default_priority=settings.celery_basic_priority,
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    },
 )
 
+# Periodic tasks (run by celery beat)
+celery_app.conf.beat_schedule = {
+    'sync-daily-message-counts': {
+        'task': 'app.services.tasks.sync_daily_message_counts',
+        'schedule': float(settings.rate_limit_sync_interval),
+    },
+}
+
+# Expired rows only pile up with the SQL OTP backend; Redis expires codes itself
+if settings.otp_backend == "sql":
+    celery_app.conf.beat_schedule['cleanup-expired-otps'] = {
+        'task': 'app.services.tasks.cleanup_expired_otps',
+        'schedule': 60 * 60,
+    }
+
+
+def gemini_task_options(subscription_tier: str) -> dict:
+    """Queue and priority for a Gemini task enqueued on behalf of a user"""
+    if subscription_tier == "pro":
+        return {'queue': GEMINI_PRO_QUEUE, 'priority': settings.celery_pro_priority}
+    return {'queue': GEMINI_BASIC_QUEUE, 'priority': settings.celery_basic_priority}
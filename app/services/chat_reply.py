@@ -0,0 +1,240 @@
+"""Steps of answering a chat message, shared by the Celery task and the asyncio worker.
+
+Each step has a sync variant for the Celery task (sync session and Redis
+client) and an async variant for `AsyncGeminiWorker`.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models.chatroom import Chatroom
+from app.models.message import Message
+from app.schemas import ChatroomResponse
+from app.services.context_builder import parse_summary, summary_key
+from app.utils.cache import update_cached_chatroom, update_cached_chatroom_sync
+from app.utils.context_buffer import (
+    append_context_message, append_context_message_sync, context_buffer_key, decode_context_buffer,
+    seed_context_buffer, seed_context_buffer_sync
+)
+from app.utils.pubsub import publish_chatroom_message, publish_chatroom_message_sync
+from app.utils.task_status import COMPLETED, set_task_status, set_task_status_sync
+
+logger = logging.getLogger(__name__)
+
+# (buffer hit, recent history oldest first, summary, id of the last message the summary covers).
+# The history may reach further back than the count window to messages not yet summarized.
+ChatContext = Tuple[bool, List[Dict], Optional[str], int]
+
+
+def _recent_messages_query(chatroom_id: int):
+    return (
+        select(Message.id, Message.role, Message.content)
+        .where(Message.chatroom_id == chatroom_id)
+        .order_by(Message.created_at.desc())
+        .limit(settings.context_max_messages)
+    )
+
+
+def _uncovered_messages_query(chatroom_id: int, covered_until_id: int, before_id: int):
+    """Messages that left the count window before the summary covered them"""
+    return (
+        select(Message.id, Message.role, Message.content)
+        .where(
+            Message.chatroom_id == chatroom_id,
+            Message.id > covered_until_id,
+            Message.id < before_id
+        )
+        .order_by(Message.created_at.desc())
+        .limit(settings.context_max_messages)
+    )
+
+
+def _needs_catch_up(history: List[Dict], covered_until_id: int) -> bool:
+    # A full window whose oldest message is not summarized may have dropped older ones
+    return len(history) >= settings.context_max_messages and history[0]['id'] > covered_until_id
+
+
+def _history(rows) -> List[Dict]:
+    return [{'id': row.id, 'role': row.role, 'content': row.content} for row in reversed(rows)]
+
+
+def _insert_reply_statement(chatroom_id: int, content: str, gemini_response_id: Optional[str]):
+    # Inserts nothing if this task's reply was already saved (redelivered or duplicated task)
+    return insert(Message).values(
+        chatroom_id=chatroom_id,
+        content=content,
+        role="assistant",
+        gemini_response_id=gemini_response_id
+    ).on_conflict_do_nothing(
+        index_elements=[Message.gemini_response_id],
+        index_where=Message.gemini_response_id.isnot(None)
+    ).returning(Message)
+
+
+def _saved_reply_query(gemini_response_id: str):
+    return select(Message).where(Message.gemini_response_id == gemini_response_id)
+
+
+def _record_reply_statement(chatroom_id: int, content: str):
+    return Chatroom.record_message(chatroom_id, content).returning(*Chatroom.list_columns())
+
+
+def load_context_sync(db: Session, redis_client, chatroom_id: int) -> ChatContext:
+    """Recent history (context buffer, else the database) and rolling summary"""
+    # Read context buffer and rolling summary in one round-trip
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.lrange(context_buffer_key(chatroom_id), 0, -1)
+        pipe.hgetall(summary_key(chatroom_id))
+        buffer_entries, summary_data = pipe.execute()
+    summary, covered_until_id = parse_summary(summary_data)
+
+    buffer_hit = bool(buffer_entries)
+    if buffer_hit:
+        history = decode_context_buffer(buffer_entries)
+    else:
+        # Buffer miss: fall back to the database
+        history = _history(db.execute(_recent_messages_query(chatroom_id)).all())
+    if _needs_catch_up(history, covered_until_id):
+        rows = db.execute(_uncovered_messages_query(chatroom_id, covered_until_id, history[0]['id'])).all()
+        history = _history(rows) + history
+    return buffer_hit, history, summary, covered_until_id
+
+
+async def load_context(redis_client, chatroom_id: int) -> ChatContext:
+    """Async variant of `load_context_sync`; holds a database session only on a buffer miss"""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.lrange(context_buffer_key(chatroom_id), 0, -1)
+        pipe.hgetall(summary_key(chatroom_id))
+        buffer_entries, summary_data = await pipe.execute()
+    summary, covered_until_id = parse_summary(summary_data)
+
+    buffer_hit = bool(buffer_entries)
+    history = decode_context_buffer(buffer_entries) if buffer_hit else None
+    if history is None or _needs_catch_up(history, covered_until_id):
+        async with AsyncSessionLocal() as db:
+            if history is None:
+                history = _history((await db.execute(_recent_messages_query(chatroom_id))).all())
+            if _needs_catch_up(history, covered_until_id):
+                rows = (await db.execute(
+                    _uncovered_messages_query(chatroom_id, covered_until_id, history[0]['id'])
+                )).all()
+                history = _history(rows) + history
+    return buffer_hit, history, summary, covered_until_id
+
+
+def save_reply_sync(db: Session, chatroom_id: int, content: str, gemini_response_id: Optional[str]):
+    """Save the assistant message and bump the chatroom counters in one transaction.
+
+    Returns (message, chatroom row with `Chatroom.list_columns()`). If the
+    task already saved its reply, nothing is written and the existing
+    message is returned with a None chatroom row.
+    """
+    assistant_message = db.execute(
+        _insert_reply_statement(chatroom_id, content, gemini_response_id)
+    ).scalars().first()
+    if assistant_message is None:
+        db.rollback()
+        return db.execute(_saved_reply_query(gemini_response_id)).scalars().one(), None
+    chatroom_row = db.execute(_record_reply_statement(chatroom_id, content)).first()
+    db.commit()
+    return assistant_message, chatroom_row
+
+
+async def save_reply(chatroom_id: int, content: str, gemini_response_id: Optional[str]):
+    """Async variant of `save_reply_sync`, on its own short-lived session.
+
+    Streamed replies have no task and are saved with a None `gemini_response_id`.
+    """
+    async with AsyncSessionLocal() as db:
+        assistant_message = (await db.execute(
+            _insert_reply_statement(chatroom_id, content, gemini_response_id)
+        )).scalars().first()
+        if assistant_message is None:
+            await db.rollback()
+            return (await db.execute(_saved_reply_query(gemini_response_id))).scalars().one(), None
+        chatroom_row = (await db.execute(_record_reply_statement(chatroom_id, content))).first()
+        await db.commit()
+    return assistant_message, chatroom_row
+
+
+def announce_reply_sync(
+    redis_client,
+    chatroom_id: int,
+    assistant_message: Message,
+    context: ChatContext,
+    task_ids: List[str],
+    duplicate: bool = False
+) -> None:
+    """Add the saved reply to the context buffer, push it to WebSockets and complete the tasks.
+
+    With `duplicate` (the reply was saved by an earlier run of the task,
+    which announced it) only the task statuses are completed.
+    """
+    if duplicate:
+        for task_id in task_ids:
+            set_task_status_sync(redis_client, task_id, COMPLETED, assistant_message_id=assistant_message.id)
+        return
+    buffer_hit, recent_history = context[0], context[1]
+    assistant_entry = {'id': assistant_message.id, 'role': 'assistant', 'content': assistant_message.content}
+    if buffer_hit or not seed_context_buffer_sync(redis_client, chatroom_id, recent_history + [assistant_entry]):
+        # The buffer exists (it may have been seeded meanwhile): just add the reply
+        append_context_message_sync(
+            redis_client, chatroom_id, assistant_message.id, 'assistant', assistant_message.content
+        )
+
+    publish_chatroom_message_sync(redis_client, chatroom_id, assistant_message)
+    for task_id in task_ids:
+        set_task_status_sync(redis_client, task_id, COMPLETED, assistant_message_id=assistant_message.id)
+
+
+async def announce_reply(
+    redis_client,
+    chatroom_id: int,
+    assistant_message: Message,
+    context: ChatContext,
+    task_ids: List[str],
+    duplicate: bool = False
+) -> None:
+    """Async variant of `announce_reply_sync`"""
+    if duplicate:
+        for task_id in task_ids:
+            await set_task_status(task_id, COMPLETED, assistant_message_id=assistant_message.id)
+        return
+    buffer_hit, recent_history = context[0], context[1]
+    assistant_entry = {'id': assistant_message.id, 'role': 'assistant', 'content': assistant_message.content}
+    if buffer_hit or not await seed_context_buffer(redis_client, chatroom_id, recent_history + [assistant_entry]):
+        await append_context_message(chatroom_id, assistant_message.id, 'assistant', assistant_message.content)
+
+    await publish_chatroom_message(chatroom_id, assistant_message)
+    for task_id in task_ids:
+        await set_task_status(task_id, COMPLETED, assistant_message_id=assistant_message.id)
+
+
+def cache_chatroom_sync(redis_client, chatroom_row) -> None:
+    """Write the bumped counters through to the owner's cached chatroom list.
+
+    Best-effort: the reply is already recorded, and a failed write-through
+    only leaves the cached list to expire. `chatroom_row` is None for a
+    duplicate reply, which changed no counters.
+    """
+    if chatroom_row is None:
+        return
+    try:
+        update_cached_chatroom_sync(
+            redis_client, chatroom_row.user_id, ChatroomResponse.model_validate(chatroom_row)
+        )
+    except Exception:
+        logger.exception("Could not update cached chatroom %s", chatroom_row.id)
+
+
+async def cache_chatroom(chatroom_row) -> None:
+    """Async variant of `cache_chatroom_sync`"""
+    if chatroom_row is None:
+        return
+    try:
+        await update_cached_chatroom(chatroom_row.user_id, ChatroomResponse.model_validate(chatroom_row))
+    except Exception:
+        logger.exception("Could not update cached chatroom %s", chatroom_row.id)
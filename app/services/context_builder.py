@@ -0,0 +1,210 @@
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Gemini uses "model" for assistant turns
+GEMINI_ROLES = {"user": "user", "assistant": "model"}
+
+# Lifetime of a chatroom's rolling summary in Redis
+SUMMARY_TTL = 7 * 24 * 60 * 60
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an AI assistant.\n"
+    "Current summary:\n{summary}\n\n"
+    "New messages to fold into the summary:\n{messages}\n\n"
+    "Write the updated summary in at most {max_words} words. Keep facts, names, decisions "
+    "and open questions; drop pleasantries. Reply with the summary only."
+)
+
+
+def summary_key(chatroom_id: int) -> str:
+    """Redis key of a chatroom's rolling summary"""
+    return f"chat_summary:{chatroom_id}"
+
+
+def parse_summary(data: Optional[dict]) -> Tuple[Optional[str], int]:
+    """Return (summary text, id of the last message it covers) from the Redis hash"""
+    if not data:
+        return None, 0
+    return data.get("summary") or None, int(data.get("covered_until_id") or 0)
+
+
+class ContextBuilder:
+    """Packs conversation history into a token budget for Gemini.
+
+    The most recent messages are kept verbatim, newest first, until the
+    budget is spent or `verbatim_limit` messages are packed. Older messages
+    are represented by a rolling summary that is extended incrementally as
+    messages fall out of the window.
+
+    Workers only see the last `max_messages` messages, so the verbatim
+    window stays two summary batches short of that: messages are folded
+    into the summary while still visible, before the count window drops them.
+    Messages that left the window unsummarized anyway (a large coalesced
+    batch, a failed summary) are read back by `app.services.chat_reply`.
+    """
+
+    def __init__(self, token_budget: int = None, summary_batch_size: int = None, max_messages: int = None):
+        self.token_budget = token_budget or settings.context_token_budget
+        self.summary_batch_size = summary_batch_size or settings.context_summary_batch_size
+        self.max_messages = max_messages or settings.context_max_messages
+
+    @property
+    def verbatim_limit(self) -> int:
+        """Most messages kept verbatim"""
+        return max(self.max_messages - 2 * self.summary_batch_size, 1)
+
+    def estimate_tokens(self, text: Optional[str]) -> int:
+        """Cheap token estimate (~4 characters per token) that avoids an API call"""
+        if not text:
+            return 0
+        return len(text) // 4 + 1
+
+    def pack_history(
+        self,
+        message: str,
+        conversation_history: List[Dict],
+        summary: Optional[str] = None,
+        covered_until_id: int = 0
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """Split history (oldest first) into (packed, evicted) for the token budget.
+
+        Messages already covered by the summary are left out of both lists.
+        """
+        if covered_until_id:
+            conversation_history = [
+                msg for msg in conversation_history if msg.get("id", 0) > covered_until_id
+            ]
+        remaining = self.token_budget - self.estimate_tokens(message) - self.estimate_tokens(summary)
+        packed_count = 0
+        for msg in reversed(conversation_history):
+            cost = self.estimate_tokens(msg["content"])
+            if cost > remaining or packed_count >= self.verbatim_limit:
+                break
+            remaining -= cost
+            packed_count += 1
+        split = len(conversation_history) - packed_count
+        return conversation_history[split:], conversation_history[:split]
+
+    def build_contents(
+        self,
+        message: str,
+        conversation_history: List[Dict] = None,
+        summary: Optional[str] = None,
+        covered_until_id: int = 0
+    ) -> List[Dict]:
+        """Build structured multi-turn Gemini contents ending with the new message"""
+        packed, _ = self.pack_history(message, conversation_history or [], summary, covered_until_id)
+
+        turns = []
+        if summary:
+            turns.append(("user", f"Summary of the earlier conversation:\n{summary}"))
+        for msg in packed:
+            turns.append((GEMINI_ROLES.get(msg["role"], "user"), msg["content"]))
+        turns.append(("user", message))
+
+        # Gemini requires alternating turns starting with the user
+        contents = []
+        for role, text in turns:
+            if contents and contents[-1]["role"] == role:
+                contents[-1]["parts"].append(text)
+            else:
+                contents.append({"role": role, "parts": [text]})
+        if contents[0]["role"] != "user":
+            contents.pop(0)
+        return contents
+
+    def _pending_summary(
+        self,
+        message: str,
+        conversation_history: List[Dict],
+        summary: Optional[str],
+        covered_until_id: int
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """Return (uncovered messages, summarization prompt), or no prompt if the batch is not full"""
+        _, uncovered = self.pack_history(message, conversation_history, summary, covered_until_id)
+        if len(uncovered) < self.summary_batch_size:
+            return uncovered, None
+
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in uncovered)
+        prompt = SUMMARY_PROMPT.format(
+            summary=summary or "(empty)",
+            messages=transcript,
+            max_words=settings.context_summary_max_words
+        )
+        return uncovered, prompt
+
+    def refresh_summary(
+        self,
+        client,
+        chatroom_id: int,
+        message: str,
+        conversation_history: List[Dict],
+        summary: Optional[str],
+        covered_until_id: int,
+        summarize: Callable[[str], str]
+    ) -> Optional[str]:
+        """Fold messages that fell out of the verbatim window into the rolling summary.
+
+        Only messages not yet covered by the summary are sent, and only once
+        at least `summary_batch_size` of them have accumulated, so each
+        message is summarized once rather than recomputing from scratch.
+        `client` is a synchronous Redis client; `summary` and
+        `covered_until_id` are the values the reply was generated with.
+        """
+        uncovered, prompt = self._pending_summary(message, conversation_history, summary, covered_until_id)
+        if prompt is None:
+            return summary
+        try:
+            updated = summarize(prompt).strip()
+        except Exception:
+            logger.exception("Failed to update summary for chatroom %s", chatroom_id)
+            return summary
+        if not updated:
+            return summary
+
+        key = summary_key(chatroom_id)
+        client.hset(key, mapping={
+            "summary": updated,
+            "covered_until_id": uncovered[-1]["id"]
+        })
+        client.expire(key, SUMMARY_TTL)
+        return updated
+
+    async def refresh_summary_async(
+        self,
+        client,
+        chatroom_id: int,
+        message: str,
+        conversation_history: List[Dict],
+        summary: Optional[str],
+        covered_until_id: int,
+        summarize: Callable[[str], Awaitable[str]]
+    ) -> Optional[str]:
+        """Async variant of `refresh_summary` for an asyncio Redis client"""
+        uncovered, prompt = self._pending_summary(message, conversation_history, summary, covered_until_id)
+        if prompt is None:
+            return summary
+        try:
+            updated = (await summarize(prompt)).strip()
+        except Exception:
+            logger.exception("Failed to update summary for chatroom %s", chatroom_id)
+            return summary
+        if not updated:
+            return summary
+
+        key = summary_key(chatroom_id)
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={
+                "summary": updated,
+                "covered_until_id": uncovered[-1]["id"]
+            })
+            pipe.expire(key, SUMMARY_TTL)
+            await pipe.execute()
+        return updated
+
+
+# Global instance
+context_builder = ContextBuilder()
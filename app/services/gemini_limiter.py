@@ -0,0 +1,246 @@
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+from google.api_core import exceptions as google_exceptions
+from app.config import settings
+from app.utils.cache import get_redis_client, get_sync_redis_client
+
+# Hash of shared limiter state: limit, failures, open_until, latency_ewma, last_decrease
+STATE_KEY = "gemini_limiter:state"
+
+# Sorted set of in-flight call leases scored by expiry, so crashed workers don't leak capacity
+LEASES_KEY = "gemini_limiter:leases"
+
+# Outcomes reported when a call finishes
+OK = "ok"
+OVERLOAD = "overload"
+NEUTRAL = "neutral"
+
+# Upstream errors that mean "back off": throttling, 5xx and timeouts
+OVERLOAD_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServerError,
+)
+
+# KEYS: state, leases. ARGV: now, lease id, lease ttl, initial limit
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local state = redis.call('HMGET', KEYS[1], 'limit', 'open_until')
+local limit = tonumber(state[1]) or tonumber(ARGV[4])
+local open_until = tonumber(state[2]) or 0
+if open_until > now then
+    return {0, tostring(open_until - now)}
+end
+if redis.call('ZCARD', KEYS[2]) >= math.max(1, math.floor(limit)) then
+    return {0, '0'}
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), ARGV[2])
+return {1, '0'}
+"""
+
+# KEYS: state, leases. ARGV: now, lease id, outcome, latency, retry after,
+# min limit, max limit, decrease factor, latency factor, failure threshold, cooldown
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[2])
+local outcome = ARGV[3]
+if outcome == 'neutral' then
+    return 0
+end
+local now = tonumber(ARGV[1])
+local latency = tonumber(ARGV[4])
+local retry_after = tonumber(ARGV[5])
+local min_limit = tonumber(ARGV[6])
+local max_limit = tonumber(ARGV[7])
+local state = redis.call('HMGET', KEYS[1], 'limit', 'failures', 'latency_ewma', 'last_decrease', 'open_until')
+local limit = tonumber(state[1]) or max_limit
+local failures = tonumber(state[2]) or 0
+local ewma = tonumber(state[3])
+if ewma and ewma <= 0 then
+    ewma = nil
+end
+local last_decrease = tonumber(state[4]) or 0
+local open_until = tonumber(state[5]) or 0
+
+if outcome == 'ok' then
+    if ewma and latency > ewma * tonumber(ARGV[9]) then
+        outcome = 'slow'
+    end
+    ewma = ewma and (0.2 * latency + 0.8 * ewma) or latency
+end
+
+if outcome == 'ok' then
+    -- Additive increase: about +1 per `limit` successful calls
+    limit = math.min(max_limit, limit + 1 / limit)
+    failures = 0
+else
+    -- Multiplicative decrease, at most once per typical call duration so
+    -- a burst of concurrent failures counts as one congestion signal
+    if now - last_decrease >= (ewma or 1) then
+        limit = math.max(min_limit, limit * tonumber(ARGV[8]))
+        last_decrease = now
+    end
+    if outcome == 'overload' then
+        failures = failures + 1
+        local open_for = retry_after
+        if failures >= tonumber(ARGV[10]) then
+            open_for = math.max(open_for, tonumber(ARGV[11]))
+            limit = min_limit
+            failures = 0
+        end
+        if open_for > 0 then
+            open_until = math.max(open_until, now + open_for)
+        end
+    end
+end
+
+redis.call('HSET', KEYS[1],
+    'limit', limit, 'failures', failures, 'latency_ewma', ewma or 0,
+    'last_decrease', last_decrease, 'open_until', open_until)
+return 1
+"""
+
+
+class GeminiUnavailable(Exception):
+    """Gemini is throttling, failing or the circuit is open; retry after `retry_after` seconds"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_overload_error(error: Exception) -> bool:
+    return isinstance(error, OVERLOAD_ERRORS)
+
+
+def retry_after_from_error(error: Exception) -> float:
+    """Server-requested back-off (RetryInfo detail or Retry-After header), in seconds"""
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("Retry-After", 0)))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def retry_delay(error: GeminiUnavailable, retries: int) -> float:
+    """Seconds before retrying a task: the server's Retry-After or jittered exponential back-off"""
+    backoff = min(2 ** retries, settings.gemini_retry_max_backoff)
+    return max(error.retry_after, backoff) * random.uniform(1.0, 1.5)
+
+
+class GeminiLimiter:
+    """AIMD concurrency limit and circuit breaker shared by all workers via Redis.
+
+    Every Gemini call holds a lease while in flight; at most `limit` leases
+    exist across all processes. Fast successful calls raise the limit
+    additively, while throttling, 5xx, timeouts and latency spikes cut it
+    multiplicatively. Repeated overload errors (or a server Retry-After)
+    open the circuit; once it closes, calls resume at the minimum limit
+    and ramp up again, so workers don't stampede a recovering API.
+    """
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = settings.gemini_limiter_enabled if enabled is None else enabled
+        self.min_limit = settings.gemini_limiter_min_limit
+        self.max_limit = settings.gemini_limiter_max_limit
+        self.acquire_timeout = settings.gemini_limiter_acquire_timeout
+        # A lease outlives the call's own timeout, then expires on its own
+        self.lease_ttl = settings.gemini_timeout * 2
+
+    def _acquire_args(self, lease: str) -> Tuple:
+        return (ACQUIRE_SCRIPT, 2, STATE_KEY, LEASES_KEY, time.time(), lease, self.lease_ttl, self.max_limit)
+
+    def _release_args(self, lease: str, outcome: str, latency: float, retry_after: float) -> Tuple:
+        return (
+            RELEASE_SCRIPT, 2, STATE_KEY, LEASES_KEY,
+            time.time(), lease, outcome, latency, retry_after,
+            self.min_limit, self.max_limit,
+            settings.gemini_limiter_decrease_factor,
+            settings.gemini_limiter_latency_factor,
+            settings.gemini_limiter_failure_threshold,
+            settings.gemini_limiter_cooldown,
+        )
+
+    def _next_delay(self, delay: float) -> Tuple[float, float]:
+        # Jittered exponential polling so waiting workers don't retry in lockstep
+        return min(delay * 2, 1.0), delay * random.uniform(0.5, 1.5)
+
+    def acquire_sync(self) -> Optional[str]:
+        """Wait for a lease; raises GeminiUnavailable if the circuit is open or no capacity frees up"""
+        if not self.enabled:
+            return None
+        client = get_sync_redis_client()
+        lease = uuid.uuid4().hex
+        deadline = time.monotonic() + self.acquire_timeout
+        delay = 0.05
+        while True:
+            granted, wait = client.eval(*self._acquire_args(lease))
+            if granted:
+                return lease
+            if float(wait) > 0:
+                raise GeminiUnavailable("Gemini circuit is open", retry_after=float(wait))
+            if time.monotonic() >= deadline:
+                raise GeminiUnavailable("Gemini concurrency limit reached", retry_after=self.acquire_timeout)
+            delay, pause = self._next_delay(delay)
+            time.sleep(pause)
+
+    def release_sync(self, lease: Optional[str], outcome: str, latency: float = 0.0, retry_after: float = 0.0) -> None:
+        """Return a lease and feed the call's outcome into the limit"""
+        if lease is None:
+            return
+        get_sync_redis_client().eval(*self._release_args(lease, outcome, latency, retry_after))
+
+    async def acquire(self) -> Optional[str]:
+        """Async variant of `acquire_sync`"""
+        if not self.enabled:
+            return None
+        client = await get_redis_client()
+        lease = uuid.uuid4().hex
+        deadline = time.monotonic() + self.acquire_timeout
+        delay = 0.05
+        while True:
+            granted, wait = await client.eval(*self._acquire_args(lease))
+            if granted:
+                return lease
+            if float(wait) > 0:
+                raise GeminiUnavailable("Gemini circuit is open", retry_after=float(wait))
+            if time.monotonic() >= deadline:
+                raise GeminiUnavailable("Gemini concurrency limit reached", retry_after=self.acquire_timeout)
+            delay, pause = self._next_delay(delay)
+            await asyncio.sleep(pause)
+
+    async def release(self, lease: Optional[str], outcome: str, latency: float = 0.0, retry_after: float = 0.0) -> None:
+        """Async variant of `release_sync`"""
+        if lease is None:
+            return
+        client = await get_redis_client()
+        await client.eval(*self._release_args(lease, outcome, latency, retry_after))
+
+    async def stats(self) -> Dict:
+        """Current shared limit, in-flight calls and circuit state"""
+        client = await get_redis_client()
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(STATE_KEY)
+            pipe.zcount(LEASES_KEY, time.time(), "+inf")
+            state, in_flight = await pipe.execute()
+        open_for = float(state.get("open_until", 0)) - time.time()
+        return {
+            "enabled": self.enabled,
+            "limit": float(state.get("limit", self.max_limit)),
+            "in_flight": in_flight,
+            "circuit_open": open_for > 0,
+            "retry_after": max(0.0, open_for),
+            "latency_ewma": float(state.get("latency_ewma", 0)),
+        }
+
+
+# Global instance
+gemini_limiter = GeminiLimiter()
@@ -1,35 +1,299 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import google.generativeai as genai
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from app.config import settings
+from app.services.context_builder import context_builder
+from app.services.gemini_limiter import (
+    NEUTRAL, OK, OVERLOAD, GeminiUnavailable, gemini_limiter, is_overload_error, retry_after_from_error
+)
+from app.services.response_cache import response_cache
+
+logger = logging.getLogger(__name__)
 
 # Configure Gemini API
 genai.configure(api_key=settings.gemini_api_key)
 
 
 class GeminiService:
-    def __init__(self):
+    """Gemini client with bounded concurrency and per-call timeouts.
+
+    One long-lived model instance is shared per process so the SDK's
+    underlying gRPC channels are reused across calls. Async callers (API
+    handlers) use the SDK's native async API; sync callers (Celery tasks)
+    run the blocking call on a dedicated thread pool.
+    """
+    
+    def __init__(self, max_concurrency: int = None, timeout: float = None):
         self.model = genai.GenerativeModel('gemini-pro')
+        self.max_concurrency = max_concurrency or settings.gemini_max_concurrency
+        self.timeout = timeout or settings.gemini_timeout
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._sync_semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="gemini"
+        )
+        # Releases of timed-out async calls, waiting for the call to stop
+        self._abandoned = set()
+    
+    def build_contents(
+        self,
+        message: str,
+        conversation_history: List[Dict] = None,
+        summary: Optional[str] = None,
+        covered_until_id: int = 0
+    ) -> List[Dict]:
+        """Build structured multi-turn contents within the context token budget"""
+        return context_builder.build_contents(message, conversation_history, summary, covered_until_id)
+    
+    def _classify(self, error: Exception) -> Tuple[str, float]:
+        """Limiter outcome and server-requested back-off for a failed call"""
+        if is_overload_error(error):
+            return OVERLOAD, retry_after_from_error(error)
+        return NEUTRAL, 0.0
     
-    async def generate_response(self, message: str, conversation_history: List[Dict[str, str]] = None) -> str:
-        """Generate response from Gemini API"""
-        try:
-            # Prepare conversation context
-            if conversation_history:
-                context = "\n".join([
-                    f"{msg['role']}: {msg['content']}" 
-                    for msg in conversation_history[-10:]  # Last 10 messages for context
-                ])
-                prompt = f"Conversation history:\n{context}\n\nUser: {message}\nAssistant:"
-            else:
-                prompt = message
-            
-            # Generate response
-            response = self.model.generate_content(prompt)
-            return response.text
+    def _finish_abandoned_sync(self, lease: Optional[str], start: float) -> None:
+        """Done-callback of a timed-out call: free its slot and lease once the thread is done"""
+        try:
+            gemini_limiter.release_sync(lease, OVERLOAD, time.monotonic() - start)
+        except Exception:
+            logger.exception("Could not release Gemini lease")
+        finally:
+            self._sync_semaphore.release()
+    
+    def _call_sync(self, prompt) -> str:
+        """One blocking Gemini call under the local and shared concurrency limits.
         
+        Raises GeminiUnavailable on throttling, 5xx, timeouts or an open
+        circuit; other errors propagate unchanged. A timed-out call keeps
+        running on its thread, so it keeps its slot and lease until it ends.
+        """
+        self._sync_semaphore.acquire()
+        try:
+            lease = gemini_limiter.acquire_sync()
+            start = time.monotonic()
+            # Run on the bounded pool so the timeout can be enforced
+            future = self._executor.submit(self.model.generate_content, prompt)
+        except BaseException:
+            self._sync_semaphore.release()
+            raise
+        try:
+            text = future.result(timeout=self.timeout).text
+        except FutureTimeoutError:
+            future.add_done_callback(lambda _: self._finish_abandoned_sync(lease, start))
+            raise GeminiUnavailable(f"Gemini call timed out after {self.timeout}s")
         except Exception as e:
-            # Fallback response in case of API failure
-            return f"I apologize, but I'm experiencing technical difficulties. Please try again later. Error: {str(e)}"
+            outcome, retry_after = self._classify(e)
+            try:
+                gemini_limiter.release_sync(lease, outcome, time.monotonic() - start, retry_after)
+            finally:
+                self._sync_semaphore.release()
+            if outcome == OVERLOAD:
+                raise GeminiUnavailable(str(e), retry_after=retry_after) from e
+            raise
+        try:
+            gemini_limiter.release_sync(lease, OK, time.monotonic() - start)
+        finally:
+            self._sync_semaphore.release()
+        return text
+    
+    async def _release(self, lease: Optional[str], outcome: str, latency: float, retry_after: float = 0.0) -> None:
+        try:
+            await gemini_limiter.release(lease, outcome, latency, retry_after)
+        finally:
+            self._semaphore.release()
+    
+    async def _finish_abandoned(self, call: asyncio.Future, lease: Optional[str], outcome: str, start: float) -> None:
+        """Free a cancelled call's slot and lease once the call has actually stopped"""
+        try:
+            await asyncio.wait({call})
+            if not call.cancelled():
+                call.exception()
+            await self._release(lease, outcome, time.monotonic() - start)
+        except Exception:
+            logger.exception("Could not release Gemini lease")
+    
+    def _abandon(self, call: asyncio.Future, lease: Optional[str], outcome: str, start: float) -> None:
+        call.cancel()
+        task = asyncio.ensure_future(self._finish_abandoned(call, lease, outcome, start))
+        self._abandoned.add(task)
+        task.add_done_callback(self._abandoned.discard)
+    
+    async def _call(self, prompt) -> str:
+        """Async variant of `_call_sync`"""
+        await self._semaphore.acquire()
+        try:
+            lease = await gemini_limiter.acquire()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        start = time.monotonic()
+        call = asyncio.ensure_future(self.model.generate_content_async(prompt))
+        try:
+            done, _ = await asyncio.wait({call}, timeout=self.timeout)
+        except asyncio.CancelledError:
+            self._abandon(call, lease, NEUTRAL, start)
+            raise
+        if not done:
+            self._abandon(call, lease, OVERLOAD, start)
+            raise GeminiUnavailable(f"Gemini call timed out after {self.timeout}s")
+        try:
+            text = call.result().text
+        except Exception as e:
+            outcome, retry_after = self._classify(e)
+            await self._release(lease, outcome, time.monotonic() - start, retry_after)
+            if outcome == OVERLOAD:
+                raise GeminiUnavailable(str(e), retry_after=retry_after) from e
+            raise
+        await self._release(lease, OK, time.monotonic() - start)
+        return text
+    
+    async def generate_response(
+        self,
+        message: str,
+        conversation_history: List[Dict] = None,
+        summary: Optional[str] = None,
+        covered_until_id: int = 0,
+        use_cache: bool = True
+    ) -> str:
+        """Generate response from Gemini API without blocking the event loop.
+        
+        Raises GeminiUnavailable when Gemini is throttling or failing so the
+        caller can retry later; other errors (bad key, invalid or blocked
+        prompt) propagate so the task is marked failed. No error text is
+        ever returned as a reply.
+        """
+        # Prepare conversation context
+        prompt = self.build_contents(message, conversation_history, summary, covered_until_id)
+        
+        # Serve repeated prompts from the response cache (opt-in)
+        use_cache = use_cache and response_cache.enabled
+        if use_cache:
+            try:
+                cached = await response_cache.get(prompt)
+            except Exception:
+                # The cache is an optimization: treat its failures as a miss
+                logger.exception("Response cache lookup failed")
+                cached = None
+            if cached is not None:
+                return cached
+        
+        # Generate response
+        text = await self._call(prompt)
+        if use_cache:
+            try:
+                await response_cache.set(prompt, text)
+            except Exception:
+                logger.exception("Response cache store failed")
+        return text
+    
+    def generate_response_sync(
+        self,
+        message: str,
+        conversation_history: List[Dict] = None,
+        summary: Optional[str] = None,
+        covered_until_id: int = 0,
+        use_cache: bool = True
+    ) -> str:
+        """Generate response from Gemini API for synchronous callers (Celery tasks).
+        
+        Errors propagate as in `generate_response`.
+        """
+        # Prepare conversation context
+        prompt = self.build_contents(message, conversation_history, summary, covered_until_id)
+        
+        # Serve repeated prompts from the response cache (opt-in)
+        use_cache = use_cache and response_cache.enabled
+        if use_cache:
+            try:
+                cached = response_cache.get_sync(prompt)
+            except Exception:
+                # The cache is an optimization: treat its failures as a miss
+                logger.exception("Response cache lookup failed")
+                cached = None
+            if cached is not None:
+                return cached
+        
+        # Generate response
+        text = self._call_sync(prompt)
+        if use_cache:
+            try:
+                response_cache.set_sync(prompt, text)
+            except Exception:
+                logger.exception("Response cache store failed")
+        return text
+    
+    async def stream_response(
+        self,
+        message: str,
+        conversation_history: List[Dict] = None,
+        summary: Optional[str] = None,
+        covered_until_id: int = 0,
+        use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        """Stream response text chunks from Gemini API as they are generated"""
+        prompt = self.build_contents(message, conversation_history, summary, covered_until_id)
+        
+        # A cached response is delivered as a single chunk (opt-in)
+        use_cache = use_cache and response_cache.enabled
+        if use_cache:
+            try:
+                cached = await response_cache.get(prompt)
+            except Exception:
+                logger.exception("Response cache lookup failed")
+                cached = None
+            if cached is not None:
+                yield cached
+                return
+        
+        chunks = []
+        async with self._semaphore:
+            lease = await gemini_limiter.acquire()
+            start = time.monotonic()
+            outcome, retry_after = NEUTRAL, 0.0
+            try:
+                response = await asyncio.wait_for(
+                    self.model.generate_content_async(prompt, stream=True),
+                    timeout=self.timeout
+                )
+                async for chunk in response:
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunk carries no text (e.g. finish or safety metadata only)
+                        continue
+                    if text:
+                        chunks.append(text)
+                        yield text
+                outcome = OK
+            except asyncio.TimeoutError:
+                outcome = OVERLOAD
+                raise GeminiUnavailable(f"Gemini call timed out after {self.timeout}s")
+            except Exception as e:
+                outcome, retry_after = self._classify(e)
+                if outcome == OVERLOAD:
+                    raise GeminiUnavailable(str(e), retry_after=retry_after) from e
+                raise
+            finally:
+                await gemini_limiter.release(lease, outcome, time.monotonic() - start, retry_after)
+        
+        if use_cache and chunks:
+            try:
+                await response_cache.set(prompt, "".join(chunks))
+            except Exception:
+                logger.exception("Response cache store failed")
+    
+    async def summarize(self, prompt: str) -> str:
+        """Async variant of `summarize_sync`; errors propagate"""
+        return await self._call(prompt)
+    
+    def summarize_sync(self, prompt: str) -> str:
+        """Run a summarization prompt; errors propagate so callers keep the old summary"""
+        return self._call_sync(prompt)
     
     def validate_api_key(self) -> bool:
         """Validate if Gemini API key is working"""
@@ -42,4 +306,3 @@ class GeminiService:
 
 # Global instance
 gemini_service = GeminiService()
-
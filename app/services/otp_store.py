@@ -0,0 +1,115 @@
+from datetime import datetime, timezone
+from sqlalchemy import exists, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.models.otp import OTP
+from app.utils.cache import get_redis_client
+from app.utils.otp import generate_otp, get_otp_expiry
+
+# Verification outcomes
+VALID = "valid"
+INVALID = "invalid"
+EXPIRED = "expired"
+TOO_MANY_ATTEMPTS = "too_many_attempts"
+
+# Consume the code on a match, otherwise count the failed attempt and burn
+# the code once attempts are used up. KEYS: otp hash. ARGV: submitted code, max attempts
+CONSUME_OTP_SCRIPT = """
+local code = redis.call('HGET', KEYS[1], 'code')
+if not code then
+    return 'invalid'
+end
+if code == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 'valid'
+end
+if redis.call('HINCRBY', KEYS[1], 'attempts', 1) >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+    return 'too_many_attempts'
+end
+return 'invalid'
+"""
+
+
+def otp_key(mobile_number: str, purpose: str) -> str:
+    """Redis hash holding the active code for a mobile number and purpose"""
+    return f"otp:{purpose}:{mobile_number}"
+
+
+class RedisOTPStore:
+    """OTP codes in Redis with native expiry.
+
+    One code is active per mobile number and purpose; issuing a new one
+    replaces it. Verification is a single atomic script that deletes the
+    code on success, so a code can be used once, and counts failures.
+    """
+
+    async def issue(self, db: AsyncSession, mobile_number: str, purpose: str) -> str:
+        code = generate_otp()
+        client = await get_redis_client()
+        key = otp_key(mobile_number, purpose)
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={"code": code, "attempts": 0})
+            pipe.expire(key, settings.otp_expiry_minutes * 60)
+            await pipe.execute()
+        return code
+
+    async def consume(self, db: AsyncSession, mobile_number: str, purpose: str, code: str) -> str:
+        client = await get_redis_client()
+        return await client.eval(
+            CONSUME_OTP_SCRIPT, 1, otp_key(mobile_number, purpose), code, settings.otp_max_attempts
+        )
+
+
+class SQLOTPStore:
+    """OTP codes in the `otps` table (fallback backend).
+
+    Expired rows are removed by the `cleanup_expired_otps` task.
+    Attempts are not limited.
+    """
+
+    async def issue(self, db: AsyncSession, mobile_number: str, purpose: str) -> str:
+        code = generate_otp()
+        db.add(OTP(
+            mobile_number=mobile_number,
+            otp_code=code,
+            purpose=purpose,
+            expires_at=get_otp_expiry(settings.otp_expiry_minutes)
+        ))
+        await db.commit()
+        return code
+
+    async def consume(self, db: AsyncSession, mobile_number: str, purpose: str, code: str) -> str:
+        matches = (
+            (OTP.mobile_number == mobile_number)
+            & (OTP.otp_code == code)
+            & (OTP.purpose == purpose)
+            & (OTP.is_used == False)
+        )
+        # Mark used in the same statement that checks it, so a code can be used once
+        result = await db.execute(
+            update(OTP)
+            .where(matches, OTP.expires_at > datetime.now(timezone.utc))
+            .values(is_used=True)
+            .returning(OTP.id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.first() is not None:
+            await db.commit()
+            return VALID
+        await db.rollback()
+
+        expired = await db.scalar(select(exists().where(matches)))
+        return EXPIRED if expired else INVALID
+
+
+def get_otp_store():
+    """OTP backend selected by `OTP_BACKEND` ("redis" or "sql")"""
+    if settings.otp_backend == "sql":
+        return SQLOTPStore()
+    return RedisOTPStore()
+
+
+# Global instance
+otp_store = get_otp_store()
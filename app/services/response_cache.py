@@ -0,0 +1,119 @@
+import hashlib
+import json
+import re
+import time
+from typing import Dict, List, Optional
+from app.config import settings
+from app.utils.cache import get_redis_client, get_sync_redis_client
+
+# Sorted set of cached entries scored by last use, for size-bounded eviction
+INDEX_KEY = "gemini_cache:index"
+
+# Hash of hit/miss counters
+STATS_KEY = "gemini_cache:stats"
+
+_whitespace = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _whitespace.sub(" ", text).strip().lower()
+
+
+class ResponseCache:
+    """Opt-in Redis cache of Gemini responses keyed by normalized prompt and context.
+
+    Entries expire after a TTL and the total number of entries is bounded;
+    the least recently used entries are evicted first.
+    """
+
+    def __init__(self, enabled: bool = None, ttl: int = None, max_entries: int = None, model_name: str = "gemini-pro"):
+        self.enabled = settings.gemini_response_cache_enabled if enabled is None else enabled
+        self.ttl = ttl or settings.gemini_response_cache_ttl
+        self.max_entries = max_entries or settings.gemini_response_cache_max_entries
+        self.model_name = model_name
+
+    def cache_key(self, contents: List[Dict]) -> str:
+        """Hash of the normalized contents that would be sent to Gemini"""
+        normalized = [
+            {"role": turn["role"], "parts": [_normalize(part) for part in turn["parts"]]}
+            for turn in contents
+        ]
+        digest = hashlib.sha256(
+            json.dumps({"model": self.model_name, "contents": normalized}, sort_keys=True).encode()
+        ).hexdigest()
+        return f"gemini_cache:{digest}"
+
+    def get_sync(self, contents: List[Dict]) -> Optional[str]:
+        """Look up a cached response (worker side)"""
+        client = get_sync_redis_client()
+        key = self.cache_key(contents)
+        response = client.get(key)
+        with client.pipeline(transaction=False) as pipe:
+            if response is not None:
+                pipe.zadd(INDEX_KEY, {key: time.time()}, xx=True)
+            pipe.hincrby(STATS_KEY, "hits" if response is not None else "misses", 1)
+            pipe.execute()
+        return response
+
+    def set_sync(self, contents: List[Dict], response: str) -> None:
+        """Store a response and evict the least recently used entries over the bound (worker side)"""
+        client = get_sync_redis_client()
+        key = self.cache_key(contents)
+        with client.pipeline(transaction=False) as pipe:
+            pipe.setex(key, self.ttl, response)
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+            pipe.zcard(INDEX_KEY)
+            size = pipe.execute()[-1]
+        if size > self.max_entries:
+            evicted = [member for member, _ in client.zpopmin(INDEX_KEY, size - self.max_entries)]
+            if evicted:
+                client.delete(*evicted)
+
+    async def get(self, contents: List[Dict]) -> Optional[str]:
+        """Look up a cached response (API side)"""
+        client = await get_redis_client()
+        key = self.cache_key(contents)
+        response = await client.get(key)
+        async with client.pipeline(transaction=False) as pipe:
+            if response is not None:
+                pipe.zadd(INDEX_KEY, {key: time.time()}, xx=True)
+            pipe.hincrby(STATS_KEY, "hits" if response is not None else "misses", 1)
+            await pipe.execute()
+        return response
+
+    async def set(self, contents: List[Dict], response: str) -> None:
+        """Store a response and evict the least recently used entries over the bound (API side)"""
+        client = await get_redis_client()
+        key = self.cache_key(contents)
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.setex(key, self.ttl, response)
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+            pipe.zcard(INDEX_KEY)
+            size = (await pipe.execute())[-1]
+        if size > self.max_entries:
+            evicted = [member for member, _ in await client.zpopmin(INDEX_KEY, size - self.max_entries)]
+            if evicted:
+                await client.delete(*evicted)
+
+    async def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        client = await get_redis_client()
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(STATS_KEY)
+            pipe.zcard(INDEX_KEY)
+            counters, size = await pipe.execute()
+        hits = int(counters.get("hits", 0))
+        misses = int(counters.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries,
+        }
+
+
+# Global instance
+response_cache = ResponseCache()
@@ -1,71 +1,141 @@
-from celery import current_task
+from celery.exceptions import Retry
 from sqlalchemy.orm import Session
 from app.services.celery_app import celery_app
+from app.services.gemini_limiter import GeminiUnavailable, retry_delay
 from app.services.gemini_service import gemini_service
+from app.services.chat_reply import announce_reply_sync, cache_chatroom_sync, load_context_sync, save_reply_sync
+from app.services.context_builder import context_builder
 from app.database import SessionLocal
-from app.models.message import Message
-from app.models.chatroom import Chatroom
+from app.models.user import User
+from app.config import settings
+from app.utils.cache import get_sync_redis_client
+from app.utils.coalesce import (
+    acquire_chatroom_lock_sync, is_latest_task_sync, merge_pending_messages,
+    pop_pending_messages_sync, release_chatroom_lock_sync, restore_pending_messages_sync
+)
+from app.utils.quota import DIRTY_QUOTA_KEY, pop_dirty_quota_counts
+from app.utils.task_status import FAILED, PROCESSING, QUEUED, set_task_status_sync
+from sqlalchemy import update
 from typing import List, Dict
 
 
-@celery_app.task(bind=True)
-def process_gemini_message(self, chatroom_id: int, user_message: str, message_id: int):
-    """Process user message with Gemini API asynchronously"""
+# Status is tracked in a compact Redis record (see app.utils.task_status),
+# so nothing is written to the Celery result backend
+@celery_app.task(bind=True, ignore_result=True, track_started=False)
+def process_gemini_message(
+    self,
+    chatroom_id: int,
+    user_message: str,
+    message_id: int,
+    bypass_cache: bool = False,
+    coalesce: bool = False,
+    gemini_retries: int = 0
+):
+    """Process user message with Gemini API asynchronously.
+
+    With `coalesce`, only the task of the chatroom's most recent message
+    generates a reply, covering every message still pending for the
+    chatroom, and generation is serialized by a per-chatroom lock.
+    `gemini_retries` counts retries caused by Gemini being unavailable;
+    waits for the chatroom lock don't use up that budget.
+    """
     db = SessionLocal()
+    redis_client = get_sync_redis_client()
+    task_ids = [self.request.id]
+    message_ids = [message_id]
+    pending = None
+    lock_token = None
+    completed = False
     try:
-        # Update task status
-        current_task.update_state(state='PROGRESS', meta={'status': 'Processing message with Gemini API'})
+        if coalesce:
+            # A newer message's task will answer this one as part of its batch
+            if not is_latest_task_sync(redis_client, chatroom_id, self.request.id):
+                return {'status': 'coalesced'}
+            lock_token = acquire_chatroom_lock_sync(redis_client, chatroom_id)
+            if lock_token is None:
+                # The previous reply is still being generated; keep replies ordered
+                raise self.retry(countdown=settings.message_coalesce_window, max_retries=None)
+            pending = pop_pending_messages_sync(redis_client, chatroom_id)
+            if not pending:
+                # Already answered as part of an earlier batch
+                return {'status': 'coalesced'}
+            user_message, message_ids, task_ids = merge_pending_messages(pending)
         
-        # Get conversation history
-        chatroom = db.query(Chatroom).filter(Chatroom.id == chatroom_id).first()
-        if not chatroom:
-            raise Exception("Chatroom not found")
+        for task_id in task_ids:
+            set_task_status_sync(redis_client, task_id, PROCESSING)
         
-        # Get recent messages for context
-        recent_messages = db.query(Message).filter(
-            Message.chatroom_id == chatroom_id
-        ).order_by(Message.created_at.desc()).limit(10).all()
+        context = load_context_sync(db, redis_client, chatroom_id)
+        _, recent_history, summary, covered_until_id = context
         
-        # Prepare conversation history
-        conversation_history = []
-        for msg in reversed(recent_messages):
-            conversation_history.append({
-                'role': msg.role,
-                'content': msg.content
-            })
+        # Prepare conversation history (the new message is sent separately)
+        conversation_history = [msg for msg in recent_history if msg['id'] not in message_ids]
         
         # Generate response from Gemini
-        gemini_response = gemini_service.generate_response(
+        gemini_response = gemini_service.generate_response_sync(
             user_message, 
-            conversation_history
+            conversation_history,
+            summary,
+            covered_until_id,
+            use_cache=not bypass_cache
         )
         
         # Save Gemini response to database
-        assistant_message = Message(
-            chatroom_id=chatroom_id,
-            content=gemini_response,
-            role="assistant",
-            gemini_response_id=self.request.id
+        assistant_message, chatroom_row = save_reply_sync(db, chatroom_id, gemini_response, self.request.id)
+        
+        # Update the context buffer, push the reply to WebSocket clients and complete the tasks
+        announce_reply_sync(
+            redis_client, chatroom_id, assistant_message, context, task_ids, duplicate=chatroom_row is None
+        )
+        completed = True
+        
+        cache_chatroom_sync(redis_client, chatroom_row)
+        
+        # Fold messages that fell out of the window into the rolling summary
+        context_builder.refresh_summary(
+            redis_client,
+            chatroom_id,
+            user_message,
+            conversation_history,
+            summary,
+            covered_until_id,
+            gemini_service.summarize_sync
         )
-        db.add(assistant_message)
-        db.commit()
         
         return {
             'status': 'completed',
-            'message_id': assistant_message.id,
-            'response': gemini_response
+            'message_id': assistant_message.id
         }
     
+    except Retry:
+        raise
+    
     except Exception as e:
         # Handle errors
         db.rollback()
-        current_task.update_state(
-            state='FAILURE',
-            meta={'error': str(e)}
-        )
+        if (
+            isinstance(e, GeminiUnavailable)
+            and not completed
+            and gemini_retries < settings.gemini_max_retries
+        ):
+            # Gemini is throttling or down: back off and retry rather than saving an error reply
+            if pending:
+                restore_pending_messages_sync(redis_client, chatroom_id, pending)
+            for task_id in task_ids:
+                set_task_status_sync(redis_client, task_id, QUEUED, retries=gemini_retries + 1)
+            raise self.retry(
+                exc=e,
+                countdown=retry_delay(e, gemini_retries),
+                max_retries=None,
+                kwargs={**self.request.kwargs, 'gemini_retries': gemini_retries + 1}
+            )
+        if not completed:
+            for task_id in task_ids:
+                set_task_status_sync(redis_client, task_id, FAILED, error=e)
         raise
     
     finally:
+        if lock_token is not None:
+            release_chatroom_lock_sync(redis_client, chatroom_id, lock_token)
         db.close()
 
 
@@ -92,3 +162,30 @@ def cleanup_expired_otps():
     finally:
         db.close()
 
+
+
+@celery_app.task
+def sync_daily_message_counts():
+    """Write-behind of Redis daily message counters to the users table"""
+    client = get_sync_redis_client()
+    entries = pop_dirty_quota_counts(client, settings.rate_limit_sync_batch_size)
+    if not entries:
+        return "No message counters to sync"
+    
+    db = SessionLocal()
+    try:
+        db.execute(update(User), [
+            {"id": user_id, "daily_message_count": count, "last_message_date": day}
+            for user_id, day, count in entries
+        ])
+        db.commit()
+        return f"Synced {len(entries)} message counters"
+    
+    except Exception as e:
+        db.rollback()
+        # Put the counters back so the next run retries them
+        client.sadd(DIRTY_QUOTA_KEY, *[f"{user_id}:{day.isoformat()}" for user_id, day, _ in entries])
+        raise
+    
+    finally:
+        db.close()
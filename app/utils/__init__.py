@@ -1,9 +1,13 @@
-from .auth import create_access_token, verify_token, get_password_hash, verify_password
+from .auth import (
+    create_access_token, verify_token, verify_token_async, get_password_hash, verify_password,
+    get_password_hash_async, verify_password_async
+)
 from .otp import generate_otp, is_otp_valid
 from .cache import get_redis_client, cache_user_chatrooms, get_cached_chatrooms, invalidate_chatroom_cache
 
 __all__ = [
-    "create_access_token", "verify_token", "get_password_hash", "verify_password",
+    "create_access_token", "verify_token", "verify_token_async", "get_password_hash", "verify_password",
+    "get_password_hash_async", "verify_password_async",
     "generate_otp", "is_otp_valid",
     "get_redis_client", "cache_user_chatrooms", "get_cached_chatrooms", "invalidate_chatroom_cache"
 ]
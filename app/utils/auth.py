@@ -1,21 +1,62 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
+import bcrypt
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from app.config import settings
+from app.utils.memory_cache import TTLCache
+from app.utils.token_revocation import fetch_token_revoked, is_token_revoked, token_digest
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt only uses the first 72 bytes of a password
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+# Bounded pool for bcrypt so hashing never blocks the event loop; the
+# extension releases the GIL, so work runs in parallel across cores
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.password_hash_workers,
+    thread_name_prefix="bcrypt"
+)
+
+# Verified token digest -> decoded claims, so repeat requests skip signature
+# checks. Entries never outlive the token's `exp`, and expire after
+# `token_cache_ttl` so each token is re-checked against the Redis revocation set
+token_cache = TTLCache(
+    maxsize=settings.token_cache_size,
+    ttl=settings.token_cache_ttl
+)
+
+
+def _password_bytes(password: str) -> bytes:
+    return password.encode("utf-8")[:BCRYPT_MAX_PASSWORD_BYTES]
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return bcrypt.checkpw(_password_bytes(plain_password), hashed_password.encode("utf-8"))
+    except ValueError:
+        # Not a bcrypt hash
+        return False
 
 
 def get_password_hash(password: str) -> str:
-    """Generate password hash"""
-    return pwd_context.hash(password)
+    """Generate password hash with the configured bcrypt cost"""
+    salt = bcrypt.gensalt(rounds=settings.bcrypt_rounds)
+    return bcrypt.hashpw(_password_bytes(password), salt).decode("utf-8")
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """`verify_password` on the bcrypt pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """`get_password_hash` on the bcrypt pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, get_password_hash, password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -33,9 +74,35 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 def verify_token(token: str) -> Optional[dict]:
     """Verify and decode JWT token"""
+    if is_token_revoked(token_digest(token)):
+        return None
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        return payload
+        return jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
     except JWTError:
         return None
 
+
+async def verify_token_async(token: str) -> Optional[dict]:
+    """Verify and decode JWT token, cached per token (request path)"""
+    digest = token_digest(token)
+    if is_token_revoked(digest):
+        return None
+    
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return dict(payload)
+    
+    try:
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError:
+        return None
+    
+    # Before caching, rule out a revocation this process hasn't heard of
+    if await fetch_token_revoked(digest):
+        return None
+    
+    exp = payload.get("exp")
+    ttl = min(exp - time.time(), settings.token_cache_ttl) if isinstance(exp, (int, float)) else None
+    if ttl is None or ttl > 0:
+        token_cache.set(digest, payload, ttl=ttl)
+    return dict(payload)
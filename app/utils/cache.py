@@ -1,55 +1,399 @@
 import json
-import redis
-from typing import List, Optional
+import redis.asyncio as redis
+from redis import Redis as SyncRedis
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from app.config import settings
+from app.schemas import ChatroomResponse, UserPrincipal
+from app.utils.memory_cache import TTLCache
 
-# Redis client
-redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+# Async Redis connection pool (created in the application lifespan)
+redis_pool: Optional[redis.BlockingConnectionPool] = None
+redis_client: Optional[redis.Redis] = None
 
+# Synchronous Redis client for Celery tasks
+sync_redis_client: Optional[SyncRedis] = None
 
-def get_redis_client():
+# Pub/sub channel carrying Redis keys to drop from every process's in-process caches
+CACHE_INVALIDATION_CHANNEL = "cache_invalidations"
+
+
+async def init_redis_pool() -> redis.Redis:
+    """Create the shared Redis connection pool and client"""
+    global redis_pool, redis_client
+    if redis_client is None:
+        redis_pool = redis.BlockingConnectionPool.from_url(
+            settings.redis_url,
+            max_connections=settings.redis_max_connections,
+            timeout=settings.redis_pool_timeout,
+            decode_responses=True
+        )
+        redis_client = redis.Redis(connection_pool=redis_pool)
+    return redis_client
+
+
+async def close_redis_pool() -> None:
+    """Close the shared Redis client and release pooled connections"""
+    global redis_pool, redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+    if redis_pool is not None:
+        await redis_pool.disconnect()
+    redis_client = None
+    redis_pool = None
+
+
+async def get_redis_client() -> redis.Redis:
     """Get Redis client instance"""
+    if redis_client is None:
+        return await init_redis_pool()
     return redis_client
 
 
-def cache_user_chatrooms(user_id: int, chatrooms: List[dict], ttl: int = 600) -> None:
-    """Cache user chatrooms with TTL (default 10 minutes)"""
-    cache_key = f"user_chatrooms:{user_id}"
-    redis_client.setex(cache_key, ttl, json.dumps(chatrooms))
+def get_sync_redis_client() -> SyncRedis:
+    """Get Redis client instance for synchronous callers (Celery tasks)"""
+    global sync_redis_client
+    if sync_redis_client is None:
+        sync_redis_client = SyncRedis.from_url(
+            settings.redis_url,
+            max_connections=settings.redis_max_connections,
+            decode_responses=True
+        )
+    return sync_redis_client
+
+
+class TieredCache:
+    """In-process LRU (L1) in front of Redis (L2), keyed by Redis key.
+
+    Each cache owns the Redis keys starting with `prefix`. Invalidations
+    are published on CACHE_INVALIDATION_CHANNEL and applied by every API
+    process (`watch_cache_invalidations`); the short L1 TTL bounds
+    staleness if one is missed. Hit counters are per process.
+    """
+
+    def __init__(self, name: str, prefix: str, maxsize: int, ttl: float):
+        self.name = name
+        self.prefix = prefix
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        # Key -> marker of the Redis read in flight for it; an invalidation
+        # drops the marker so a read that raced it isn't stored in L1
+        self._loading: Dict[str, object] = {}
+        tiered_caches[name] = self
+
+    async def get(self, key: str, load: Callable[[redis.Redis], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """Return the L1 value, else `load` it from Redis and keep it in L1"""
+        value = self.local.get(key)
+        if value is not None:
+            self.l1_hits += 1
+            return value
+        marker = self.start_load(key)
+        try:
+            value = await load(await get_redis_client())
+        finally:
+            fresh = self.finish_load(key, marker)
+        if value is None:
+            self.misses += 1
+            return None
+        self.l2_hits += 1
+        if fresh:
+            self.local.set(key, value)
+        return value
+
+    def start_load(self, key: str) -> object:
+        """Mark a read of `key` as in flight; pass the marker to `finish_load`"""
+        marker = self._loading[key] = object()
+        return marker
+
+    def finish_load(self, key: str, marker: object) -> bool:
+        """End a read; False if the key was invalidated meanwhile (don't keep the value)"""
+        fresh = self._loading.get(key) is marker
+        if fresh:
+            del self._loading[key]
+        return fresh
+
+    def set_local(self, key: str, value: Any) -> None:
+        self.local.set(key, value)
+
+    def evict_local(self, key: str) -> None:
+        self._loading.pop(key, None)
+        self.local.delete(key)
+
+    def clear_local(self) -> None:
+        self._loading.clear()
+        self.local.clear()
+
+    def stats(self) -> Dict:
+        """Hits per tier and hit ratios in this process"""
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        l2_lookups = self.l2_hits + self.misses
+        return {
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "l1_hit_ratio": self.l1_hits / lookups if lookups else 0.0,
+            "l2_hit_ratio": self.l2_hits / l2_lookups if l2_lookups else 0.0,
+            "hit_ratio": (self.l1_hits + self.l2_hits) / lookups if lookups else 0.0,
+            "l1_entries": len(self.local),
+        }
+
+
+# Two-tier caches by name
+tiered_caches: Dict[str, TieredCache] = {}
+
+principal_cache = TieredCache(
+    "user_principal", "user_principal:",
+    settings.principal_local_cache_size, settings.principal_local_cache_ttl
+)
+session_cache = TieredCache(
+    "user_session", "user_session:", settings.local_cache_size, settings.local_cache_ttl
+)
+chatroom_list_cache = TieredCache(
+    "user_chatrooms", "user_chatrooms:", settings.local_cache_size, settings.local_cache_ttl
+)
+
+
+def evict_local_key(key: str) -> None:
+    """Drop a Redis key from the L1 cache that owns it in this process"""
+    for cache in tiered_caches.values():
+        if key.startswith(cache.prefix):
+            cache.evict_local(key)
+            return
+
+
+def clear_local_caches() -> None:
+    for cache in tiered_caches.values():
+        cache.clear_local()
+
+
+def tiered_cache_stats() -> Dict[str, Dict]:
+    return {name: cache.stats() for name, cache in tiered_caches.items()}
+
+
+async def clear_local_caches_async() -> None:
+    """`clear_local_caches` as a pub/sub reconnect handler"""
+    clear_local_caches()
+
+
+async def invalidate_keys(*keys: str) -> None:
+    """Delete keys from Redis and from the L1 caches of every process"""
+    for key in keys:
+        evict_local_key(key)
+    client = await get_redis_client()
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.delete(*keys)
+        for key in keys:
+            pipe.publish(CACHE_INVALIDATION_CHANNEL, key)
+        await pipe.execute()
+
+
+# Chatroom list cache lifetime; writes refresh it, so active lists stay warm
+CHATROOM_LIST_TTL = 600
+
+# Store a chatroom's list entry unless the cache already holds a newer one
+# (higher message_count), and extend the lifetime of the whole cached list.
+# KEYS: user's list, user's entries, ready marker.
+# ARGV: chatroom id, updated_at score, message_count, entry JSON, ttl
+UPSERT_CHATROOM_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[2], ARGV[1] .. ':version'))
+if current and current > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[4], ARGV[1] .. ':version', ARGV[3])
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+-- The marker is refreshed first (only if the list is loaded) so it never outlives the entries
+redis.call('EXPIRE', KEYS[3], ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return 1
+"""
+
+# The list as a JSON array, most recently updated first, or nil if it isn't
+# fully cached. KEYS: ready marker, user's list, user's entries
+GET_CHATROOM_LIST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local entries = {}
+for _, id in ipairs(redis.call('ZREVRANGE', KEYS[2], 0, -1)) do
+    local entry = redis.call('HGET', KEYS[3], id)
+    if not entry then
+        return false
+    end
+    entries[#entries + 1] = entry
+end
+return '[' .. table.concat(entries, ',') .. ']'
+"""
 
 
-def get_cached_chatrooms(user_id: int) -> Optional[List[dict]]:
-    """Get cached user chatrooms"""
-    cache_key = f"user_chatrooms:{user_id}"
-    cached_data = redis_client.get(cache_key)
-    if cached_data:
-        return json.loads(cached_data)
-    return None
+def chatroom_list_key(user_id: int) -> str:
+    """Redis sorted set of the user's chatroom ids scored by updated_at"""
+    return f"user_chatrooms:{user_id}"
 
 
-def invalidate_chatroom_cache(user_id: int) -> None:
-    """Invalidate user chatroom cache"""
-    cache_key = f"user_chatrooms:{user_id}"
-    redis_client.delete(cache_key)
+def chatroom_entries_key(user_id: int) -> str:
+    """Redis hash of the user's serialized chatroom list entries (`{id}`) and versions (`{id}:version`)"""
+    return f"user_chatroom_entries:{user_id}"
 
 
-def cache_user_session(user_id: int, session_data: dict, ttl: int = 86400) -> None:
+def chatroom_list_ready_key(user_id: int) -> str:
+    """Set once the user's whole chatroom list has been loaded into the cache"""
+    return f"user_chatrooms_ready:{user_id}"
+
+
+def _chatroom_list_keys(user_id: int) -> Tuple[str, str, str]:
+    return chatroom_list_key(user_id), chatroom_entries_key(user_id), chatroom_list_ready_key(user_id)
+
+
+def _upsert_chatroom_args(user_id: int, chatroom: ChatroomResponse, ttl: int) -> Tuple:
+    return (
+        UPSERT_CHATROOM_SCRIPT, 3, *_chatroom_list_keys(user_id),
+        chatroom.id, chatroom.updated_at.timestamp(), chatroom.message_count or 0,
+        chatroom.model_dump_json(), ttl
+    )
+
+
+async def cache_user_chatrooms(user_id: int, chatrooms: List[ChatroomResponse], ttl: int = CHATROOM_LIST_TTL) -> None:
+    """Load the user's full chatroom list (from the database) into the cache.
+
+    Entries already updated by a newer write are kept, so a list read
+    from the database before a concurrent message never overwrites it.
+    """
+    client = await get_redis_client()
+    async with client.pipeline(transaction=True) as pipe:
+        # Marked first so it never outlives the entries it vouches for
+        pipe.set(chatroom_list_ready_key(user_id), 1, ex=ttl)
+        for chatroom in chatrooms:
+            pipe.eval(*_upsert_chatroom_args(user_id, chatroom, ttl))
+        await pipe.execute()
+
+
+async def update_cached_chatroom(user_id: int, chatroom: ChatroomResponse, ttl: int = CHATROOM_LIST_TTL) -> None:
+    """Write a created or updated chatroom through to the user's cached list (API side)"""
+    key = chatroom_list_key(user_id)
+    chatroom_list_cache.evict_local(key)
+    client = await get_redis_client()
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.eval(*_upsert_chatroom_args(user_id, chatroom, ttl))
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, key)
+        await pipe.execute()
+
+
+def update_cached_chatroom_sync(client, user_id: int, chatroom: ChatroomResponse, ttl: int = CHATROOM_LIST_TTL) -> None:
+    """Write an updated chatroom through to the user's cached list (worker side)"""
+    with client.pipeline(transaction=False) as pipe:
+        pipe.eval(*_upsert_chatroom_args(user_id, chatroom, ttl))
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, chatroom_list_key(user_id))
+        pipe.execute()
+
+
+async def get_cached_chatrooms(user_id: int) -> Optional[str]:
+    """Get the cached chatroom list as a JSON array, ready to send as is"""
+    async def load(client: redis.Redis) -> Optional[str]:
+        return await client.eval(
+            GET_CHATROOM_LIST_SCRIPT, 3,
+            chatroom_list_ready_key(user_id), chatroom_list_key(user_id), chatroom_entries_key(user_id)
+        )
+    return await chatroom_list_cache.get(chatroom_list_key(user_id), load)
+
+
+async def invalidate_chatroom_cache(user_id: int) -> None:
+    """Invalidate user chatroom cache (the next list call reloads it)"""
+    await invalidate_keys(*_chatroom_list_keys(user_id))
+
+
+def user_session_key(user_id: int) -> str:
+    return f"user_session:{user_id}"
+
+
+async def cache_user_session(user_id: int, session_data: dict, ttl: int = 86400) -> None:
     """Cache user session data (default 24 hours)"""
-    cache_key = f"user_session:{user_id}"
-    redis_client.setex(cache_key, ttl, json.dumps(session_data))
+    key = user_session_key(user_id)
+    session_cache.evict_local(key)
+    client = await get_redis_client()
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.setex(key, ttl, json.dumps(session_data, default=str))
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, key)
+        await pipe.execute()
 
 
-def get_cached_user_session(user_id: int) -> Optional[dict]:
-    """Get cached user session data"""
-    cache_key = f"user_session:{user_id}"
-    cached_data = redis_client.get(cache_key)
-    if cached_data:
-        return json.loads(cached_data)
-    return None
+async def get_cached_user_session(user_id: int) -> Optional[dict]:
+    """Get cached user session data, checking the in-process cache first"""
+    async def load(client: redis.Redis) -> Optional[dict]:
+        cached_data = await client.get(user_session_key(user_id))
+        return json.loads(cached_data) if cached_data else None
+    return await session_cache.get(user_session_key(user_id), load)
 
 
-def invalidate_user_session(user_id: int) -> None:
+async def invalidate_user_session(user_id: int) -> None:
     """Invalidate user session cache"""
-    cache_key = f"user_session:{user_id}"
-    redis_client.delete(cache_key)
+    await invalidate_keys(user_session_key(user_id))
+
+
+# Lifetime of a principal's version counter; must outlast any database read
+# that fills the cache
+PRINCIPAL_VERSION_TTL = 24 * 60 * 60
+
+# Store a principal read from the database unless the principal was
+# invalidated since the read began (version counter moved).
+# KEYS: principal, version. ARGV: version read before the database, ttl, principal JSON
+SET_PRINCIPAL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[2])
+return 1
+"""
+
+
+def user_principal_key(user_id: int) -> str:
+    return f"user_principal:{user_id}"
+
+
+def user_principal_version_key(user_id: int) -> str:
+    """Counter bumped by every principal invalidation"""
+    return f"user_principal_version:{user_id}"
+
+
+async def get_user_principal_version(user_id: int) -> str:
+    """Version to pass to `cache_user_principal`; read it before loading the user from the database"""
+    client = await get_redis_client()
+    return await client.get(user_principal_version_key(user_id)) or "0"
+
+
+async def cache_user_principal(principal: UserPrincipal, version: str, ttl: Optional[int] = None) -> None:
+    """Cache the authenticated user principal in process and in Redis.
+
+    Dropped if the principal was invalidated after `version` was read, so
+    a database read that raced an update can't cache the old values.
+    """
+    client = await get_redis_client()
+    cache_key = user_principal_key(principal.id)
+    marker = principal_cache.start_load(cache_key)
+    stored = await client.eval(
+        SET_PRINCIPAL_SCRIPT, 2, cache_key, user_principal_version_key(principal.id),
+        version, ttl or settings.principal_cache_ttl, principal.model_dump_json()
+    )
+    if principal_cache.finish_load(cache_key, marker) and stored:
+        principal_cache.set_local(cache_key, principal)
+
+
+async def get_cached_user_principal(user_id: int) -> Optional[UserPrincipal]:
+    """Get cached user principal, checking the in-process cache first"""
+    async def load(client: redis.Redis) -> Optional[UserPrincipal]:
+        cached_data = await client.get(user_principal_key(user_id))
+        return UserPrincipal.model_validate_json(cached_data) if cached_data else None
+    return await principal_cache.get(user_principal_key(user_id), load)
+
 
+async def invalidate_user_principal(user_id: int) -> None:
+    """Invalidate cached user principal in Redis and in every process"""
+    # Bump the version first, so a cache fill still in flight is dropped
+    client = await get_redis_client()
+    version_key = user_principal_version_key(user_id)
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.incr(version_key)
+        pipe.expire(version_key, PRINCIPAL_VERSION_TTL)
+        await pipe.execute()
+    await invalidate_keys(user_principal_key(user_id))
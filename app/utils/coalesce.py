@@ -0,0 +1,123 @@
+import json
+import uuid
+from typing import List, Optional, Tuple
+from app.config import settings
+from app.utils.cache import get_redis_client
+
+# Pending-message bookkeeping outlives any sane debounce window
+COALESCE_KEY_TTL = 60 * 60
+
+# Delete the lock only if it is still held by the caller
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def pending_messages_key(chatroom_id: int) -> str:
+    """Redis list of user messages waiting for a coalesced reply (oldest first)"""
+    return f"chat_pending:{chatroom_id}"
+
+
+def latest_task_key(chatroom_id: int) -> str:
+    """Id of the task queued for the chatroom's most recent message"""
+    return f"chat_pending_latest:{chatroom_id}"
+
+
+def chatroom_lock_key(chatroom_id: int) -> str:
+    """Lock held while a reply for the chatroom is being generated"""
+    return f"chat_lock:{chatroom_id}"
+
+
+async def queue_pending_message(chatroom_id: int, message_id: int, content: str, task_id: str) -> None:
+    """Add a message to the chatroom's pending batch and make its task the latest (API side)"""
+    client = await get_redis_client()
+    entry = json.dumps({"message_id": message_id, "content": content, "task_id": task_id})
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.rpush(pending_messages_key(chatroom_id), entry)
+        pipe.expire(pending_messages_key(chatroom_id), COALESCE_KEY_TTL)
+        pipe.set(latest_task_key(chatroom_id), task_id, ex=COALESCE_KEY_TTL)
+        await pipe.execute()
+
+
+def merge_pending_messages(entries: List[str]) -> Tuple[str, List[int], List[str]]:
+    """Return (combined content, message ids, task ids) for a popped batch"""
+    batch = [json.loads(entry) for entry in entries]
+    content = "\n\n".join(item["content"] for item in batch)
+    return content, [item["message_id"] for item in batch], [item["task_id"] for item in batch]
+
+
+def is_latest_task_sync(client, chatroom_id: int, task_id: str) -> bool:
+    """Whether no newer message has arrived for the chatroom (worker side)"""
+    latest = client.get(latest_task_key(chatroom_id))
+    return latest is None or latest == task_id
+
+
+def acquire_chatroom_lock_sync(client, chatroom_id: int) -> Optional[str]:
+    """Take the chatroom's generation lock; returns the release token or None if held"""
+    token = uuid.uuid4().hex
+    if client.set(chatroom_lock_key(chatroom_id), token, nx=True, ex=settings.message_coalesce_lock_timeout):
+        return token
+    return None
+
+
+def release_chatroom_lock_sync(client, chatroom_id: int, token: str) -> None:
+    client.eval(RELEASE_LOCK_SCRIPT, 1, chatroom_lock_key(chatroom_id), token)
+
+
+def pop_pending_messages_sync(client, chatroom_id: int) -> List[str]:
+    """Atomically take every pending message of the chatroom"""
+    key = pending_messages_key(chatroom_id)
+    with client.pipeline(transaction=True) as pipe:
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        entries, _ = pipe.execute()
+    return entries
+
+
+def restore_pending_messages_sync(client, chatroom_id: int, entries: List[str]) -> None:
+    """Put a popped batch back at the front of the pending list (generation failed)"""
+    key = pending_messages_key(chatroom_id)
+    with client.pipeline(transaction=True) as pipe:
+        pipe.lpush(key, *reversed(entries))
+        pipe.expire(key, COALESCE_KEY_TTL)
+        pipe.execute()
+
+
+async def is_latest_task(client, chatroom_id: int, task_id: str) -> bool:
+    """Async variant of `is_latest_task_sync`"""
+    latest = await client.get(latest_task_key(chatroom_id))
+    return latest is None or latest == task_id
+
+
+async def acquire_chatroom_lock(client, chatroom_id: int) -> Optional[str]:
+    """Async variant of `acquire_chatroom_lock_sync`"""
+    token = uuid.uuid4().hex
+    if await client.set(chatroom_lock_key(chatroom_id), token, nx=True, ex=settings.message_coalesce_lock_timeout):
+        return token
+    return None
+
+
+async def release_chatroom_lock(client, chatroom_id: int, token: str) -> None:
+    await client.eval(RELEASE_LOCK_SCRIPT, 1, chatroom_lock_key(chatroom_id), token)
+
+
+async def pop_pending_messages(client, chatroom_id: int) -> List[str]:
+    """Async variant of `pop_pending_messages_sync`"""
+    key = pending_messages_key(chatroom_id)
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        entries, _ = await pipe.execute()
+    return entries
+
+
+async def restore_pending_messages(client, chatroom_id: int, entries: List[str]) -> None:
+    """Async variant of `restore_pending_messages_sync`"""
+    key = pending_messages_key(chatroom_id)
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.lpush(key, *reversed(entries))
+        pipe.expire(key, COALESCE_KEY_TTL)
+        await pipe.execute()
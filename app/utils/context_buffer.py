@@ -0,0 +1,81 @@
+import json
+from typing import Dict, List
+from app.config import settings
+from app.utils.cache import get_redis_client
+
+# Idle chatrooms drop their buffer and are reseeded from the database
+CONTEXT_BUFFER_TTL = 24 * 60 * 60
+
+# Create the buffer only if it is still missing, so messages appended since
+# the seed was read from the database aren't wiped. KEYS: buffer. ARGV: ttl, entries...
+SEED_BUFFER_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def context_buffer_key(chatroom_id: int) -> str:
+    """Redis list holding a chatroom's most recent messages (oldest first)"""
+    return f"chat_context:{chatroom_id}"
+
+
+def _encode(message_id: int, role: str, content: str) -> str:
+    return json.dumps({"id": message_id, "role": role, "content": content})
+
+
+def decode_context_buffer(entries: List[str]) -> List[Dict]:
+    """Decode buffer entries into conversation history dicts"""
+    return [json.loads(entry) for entry in entries]
+
+
+def _append(pipe, chatroom_id: int, message_id: int, role: str, content: str) -> None:
+    key = context_buffer_key(chatroom_id)
+    # RPUSHX only appends to an existing buffer, so a partial buffer is never
+    # created; missing buffers are seeded in full from the database
+    pipe.rpushx(key, _encode(message_id, role, content))
+    pipe.ltrim(key, -settings.context_max_messages, -1)
+    pipe.expire(key, CONTEXT_BUFFER_TTL)
+
+
+async def append_context_message(chatroom_id: int, message_id: int, role: str, content: str) -> None:
+    """Append a message to the chatroom's context buffer (API side)"""
+    client = await get_redis_client()
+    async with client.pipeline(transaction=True) as pipe:
+        _append(pipe, chatroom_id, message_id, role, content)
+        await pipe.execute()
+
+
+def append_context_message_sync(client, chatroom_id: int, message_id: int, role: str, content: str) -> None:
+    """Append a message to the chatroom's context buffer (worker side)"""
+    with client.pipeline(transaction=True) as pipe:
+        _append(pipe, chatroom_id, message_id, role, content)
+        pipe.execute()
+
+
+def _seed_args(chatroom_id: int, messages: List[Dict]) -> tuple:
+    entries = [
+        _encode(msg["id"], msg["role"], msg["content"])
+        for msg in messages[-settings.context_max_messages:]
+    ]
+    return (SEED_BUFFER_SCRIPT, 1, context_buffer_key(chatroom_id), CONTEXT_BUFFER_TTL, *entries)
+
+
+async def seed_context_buffer(client, chatroom_id: int, messages: List[Dict]) -> bool:
+    """Async variant of `seed_context_buffer_sync`"""
+    if not messages:
+        return False
+    return bool(await client.eval(*_seed_args(chatroom_id, messages)))
+
+
+def seed_context_buffer_sync(client, chatroom_id: int, messages: List[Dict]) -> bool:
+    """Create the chatroom's missing context buffer from the given messages (oldest first).
+
+    Returns False, leaving the buffer untouched, if it already exists.
+    """
+    if not messages:
+        return False
+    return bool(client.eval(*_seed_args(chatroom_id, messages)))
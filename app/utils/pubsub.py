@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+from app.schemas import MessageResponse
+from app.utils.cache import (
+    CACHE_INVALIDATION_CHANNEL, clear_local_caches, clear_local_caches_async, evict_local_key, get_redis_client
+)
+
+logger = logging.getLogger(__name__)
+
+# Subscribed for the hub's lifetime so its connection stays open with no listeners
+HUB_CHANNEL = "pubsub_hub"
+
+# Events buffered per listener before new ones are dropped (slow client)
+LISTENER_QUEUE_SIZE = 100
+
+
+def chatroom_channel(chatroom_id: int) -> str:
+    """Pub/sub channel carrying a chatroom's new messages"""
+    return f"chat_events:{chatroom_id}"
+
+
+def message_event(chatroom_id: int, message) -> str:
+    """Serialize a saved message as a chatroom event"""
+    return json.dumps({
+        "type": "message",
+        "chatroom_id": chatroom_id,
+        "message": MessageResponse.model_validate(message).model_dump(mode="json")
+    })
+
+
+def publish_chatroom_message_sync(client, chatroom_id: int, message) -> None:
+    """Announce a saved message to the chatroom's subscribers (worker side)"""
+    client.publish(chatroom_channel(chatroom_id), message_event(chatroom_id, message))
+
+
+async def publish_chatroom_message(chatroom_id: int, message) -> None:
+    """Announce a saved message to the chatroom's subscribers (API side)"""
+    client = await get_redis_client()
+    await client.publish(chatroom_channel(chatroom_id), message_event(chatroom_id, message))
+
+
+class PubSubHub:
+    """Fans Redis pub/sub messages out to in-process listeners.
+
+    All listeners in the process share one subscriber connection; a
+    channel is subscribed while it has at least one listener, so the
+    number of Redis connections does not grow with open WebSockets.
+    """
+
+    def __init__(self, queue_size: int = LISTENER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._listeners: Dict[str, Set[asyncio.Queue]] = {}
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._reconnect_handlers: List[Callable[[], Awaitable[None]]] = []
+        self._handler_tasks: Set[asyncio.Task] = set()
+
+    def add_reconnect_handler(self, handler: Callable[[], Awaitable[None]]) -> None:
+        """Run `handler` whenever the subscriber reconnects (messages sent meanwhile are lost)"""
+        self._reconnect_handlers.append(handler)
+
+    def remove_reconnect_handler(self, handler: Callable[[], Awaitable[None]]) -> None:
+        if handler in self._reconnect_handlers:
+            self._reconnect_handlers.remove(handler)
+
+    async def _run_reconnect_handler(self, handler: Callable[[], Awaitable[None]]) -> None:
+        try:
+            await handler()
+        except Exception:
+            logger.exception("Pub/sub reconnect handler failed")
+
+    def _notify_reconnect(self) -> None:
+        for handler in list(self._reconnect_handlers):
+            task = asyncio.create_task(self._run_reconnect_handler(handler))
+            self._handler_tasks.add(task)
+            task.add_done_callback(self._handler_tasks.discard)
+
+    async def start(self) -> None:
+        """Open the subscriber connection and start dispatching"""
+        # Locked so concurrent first listeners don't each open a subscriber
+        async with self._lock:
+            if self._reader is not None:
+                return
+            client = await get_redis_client()
+            self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+            await self._pubsub.subscribe(HUB_CHANNEL)
+            self._reader = asyncio.create_task(self._read())
+
+    async def stop(self) -> None:
+        """Stop dispatching and release the subscriber connection"""
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        self._reader = None
+        self._pubsub = None
+        self._listeners.clear()
+
+    async def _read(self) -> None:
+        resync = False
+        while True:
+            connection = self._pubsub.connection
+            if connection is None or not connection.is_connected:
+                resync = True
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The connection is re-established (and channels resubscribed) on the next read
+                logger.exception("Pub/sub read failed")
+                resync = True
+                await asyncio.sleep(1)
+                continue
+            if resync:
+                # Reconnected: let listeners recover what was published while disconnected
+                resync = False
+                self._notify_reconnect()
+            if message is None:
+                continue
+            for queue in list(self._listeners.get(message["channel"], ())):
+                try:
+                    queue.put_nowait(message["data"])
+                except asyncio.QueueFull:
+                    logger.warning("Dropping event on %s for a slow listener", message["channel"])
+
+    @asynccontextmanager
+    async def listen(self, channel: str, queue_size: Optional[int] = None) -> AsyncIterator[asyncio.Queue]:
+        """Yield a queue receiving the channel's messages until the block exits.
+
+        `queue_size` overrides the hub's per-listener buffer (0 = unbounded).
+        """
+        await self.start()
+        queue = asyncio.Queue(maxsize=self.queue_size if queue_size is None else queue_size)
+        async with self._lock:
+            listeners = self._listeners.setdefault(channel, set())
+            if not listeners:
+                await self._pubsub.subscribe(channel)
+            listeners.add(queue)
+        try:
+            yield queue
+        finally:
+            async with self._lock:
+                listeners = self._listeners.get(channel, set())
+                listeners.discard(queue)
+                if not listeners and self._pubsub is not None:
+                    self._listeners.pop(channel, None)
+                    await self._pubsub.unsubscribe(channel)
+
+
+# Global instance
+pubsub_hub = PubSubHub()
+
+
+async def watch_cache_invalidations() -> None:
+    """Apply cache invalidations from every process to this process's L1 caches"""
+    # Invalidations published while the subscriber was reconnecting are lost
+    pubsub_hub.add_reconnect_handler(clear_local_caches_async)
+    while True:
+        try:
+            # Unbounded queue: a dropped invalidation would leave a stale L1 entry
+            async with pubsub_hub.listen(CACHE_INVALIDATION_CHANNEL, queue_size=0) as events:
+                # Invalidations may have been missed while unsubscribed
+                clear_local_caches()
+                while True:
+                    evict_local_key(await events.get())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Cache invalidation watcher failed; restarting")
+            await asyncio.sleep(1)
@@ -0,0 +1,96 @@
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+from app.config import settings
+from app.utils.cache import get_redis_client
+
+# Users whose daily counter changed since the last write-behind sync
+DIRTY_QUOTA_KEY = "message_quota:dirty"
+
+# Keep counters a little past the end of their day so the sync can read them
+QUOTA_KEY_TTL = 2 * 24 * 60 * 60
+
+# Atomically consume one message from the daily quota.
+# KEYS[1] = counter key, KEYS[2] = dirty set
+# ARGV[1] = daily limit, ARGV[2] = key TTL, ARGV[3] = dirty member
+# Returns the new count, or -1 if the limit was already reached.
+CONSUME_QUOTA_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if count > tonumber(ARGV[1]) then
+    redis.call('DECR', KEYS[1])
+    return -1
+end
+redis.call('SADD', KEYS[2], ARGV[3])
+return count
+"""
+
+
+def quota_day() -> date:
+    """Current quota day (UTC)"""
+    return datetime.utcnow().date()
+
+
+def quota_key(user_id: int, day: date) -> str:
+    """Redis key holding a user's message count for a day"""
+    return f"message_quota:{user_id}:{day.isoformat()}"
+
+
+def daily_limit_for_tier(subscription_tier: Optional[str]) -> int:
+    """Daily message limit for a subscription tier"""
+    if subscription_tier == "pro":
+        return settings.pro_daily_limit
+    return settings.basic_daily_limit
+
+
+async def consume_message_quota(user_id: int, subscription_tier: Optional[str]) -> int:
+    """Consume one message from today's quota, returning the new count or -1 if exhausted"""
+    client = await get_redis_client()
+    day = quota_day()
+    return await client.eval(
+        CONSUME_QUOTA_SCRIPT,
+        2,
+        quota_key(user_id, day),
+        DIRTY_QUOTA_KEY,
+        daily_limit_for_tier(subscription_tier),
+        QUOTA_KEY_TTL,
+        f"{user_id}:{day.isoformat()}"
+    )
+
+
+async def refund_message_quota(user_id: int) -> None:
+    """Give back a message consumed for a request that did not complete"""
+    client = await get_redis_client()
+    day = quota_day()
+    count = await client.decr(quota_key(user_id, day))
+    if count < 0:
+        await client.set(quota_key(user_id, day), 0, ex=QUOTA_KEY_TTL)
+    await client.sadd(DIRTY_QUOTA_KEY, f"{user_id}:{day.isoformat()}")
+
+
+async def get_daily_message_count(user_id: int) -> int:
+    """Messages sent by the user today"""
+    client = await get_redis_client()
+    count = await client.get(quota_key(user_id, quota_day()))
+    return int(count) if count else 0
+
+
+def pop_dirty_quota_counts(client, batch_size: int) -> List[Tuple[int, date, int]]:
+    """Pop changed counters for write-behind as (user_id, day, count) tuples"""
+    members = client.spop(DIRTY_QUOTA_KEY, batch_size) or []
+    latest_days = {}
+    for member in members:
+        user_id, day = member.split(":", 1)
+        user_id, day = int(user_id), date.fromisoformat(day)
+        # Only the most recent day matters for the users table
+        if user_id not in latest_days or day > latest_days[user_id]:
+            latest_days[user_id] = day
+    if not latest_days:
+        return []
+    entries = list(latest_days.items())
+    counts = client.mget([quota_key(user_id, day) for user_id, day in entries])
+    return [
+        (user_id, day, int(count or 0))
+        for (user_id, day), count in zip(entries, counts)
+    ]
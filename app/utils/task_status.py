@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from app.config import settings
+from app.utils.cache import get_redis_client
+
+# Task states, in order
+QUEUED = "queued"
+PROCESSING = "processing"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Longest error text kept in a status record
+MAX_ERROR_LENGTH = 500
+
+
+def task_status_key(task_id: str) -> str:
+    """Redis hash holding a Gemini task's compact status record"""
+    return f"task_status:{task_id}"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _status_fields(state: str, **fields) -> Dict[str, str]:
+    """Status fields to merge into the record, stamped with the state's timestamp"""
+    mapping = {"state": state}
+    if state == QUEUED:
+        mapping["queued_at"] = _now()
+    elif state == PROCESSING:
+        mapping["started_at"] = _now()
+    else:
+        mapping["finished_at"] = _now()
+    for name, value in fields.items():
+        if value is not None:
+            mapping[name] = str(value)[:MAX_ERROR_LENGTH] if name == "error" else value
+    return mapping
+
+
+async def set_task_status(task_id: str, state: str, **fields) -> None:
+    """Update a task's status record and refresh its TTL (API and async worker side)"""
+    client = await get_redis_client()
+    key = task_status_key(task_id)
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping=_status_fields(state, **fields))
+        pipe.expire(key, settings.task_status_ttl)
+        await pipe.execute()
+
+
+def set_task_status_sync(client, task_id: str, state: str, **fields) -> None:
+    """Update a task's status record and refresh its TTL (worker side)"""
+    key = task_status_key(task_id)
+    with client.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping=_status_fields(state, **fields))
+        pipe.expire(key, settings.task_status_ttl)
+        pipe.execute()
+
+
+async def get_task_status(task_id: str) -> Optional[Dict[str, str]]:
+    """Return a task's status record, or None if unknown or expired"""
+    client = await get_redis_client()
+    return await client.hgetall(task_status_key(task_id)) or None
@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Dict
+from app.utils.cache import get_redis_client
+from app.utils.pubsub import pubsub_hub
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of revoked token digests scored by the token's expiry
+REVOKED_TOKENS_KEY = "revoked_tokens"
+
+# Revocations are broadcast so every process updates its local set at once
+REVOCATION_CHANNEL = "token_revocations"
+
+# Local mirror of the revocation set (digest -> exp), checked on every request
+# without I/O. Deliberately unbounded: evicting an entry would un-revoke a token
+_revoked: Dict[str, float] = {}
+
+
+def token_digest(token: str) -> str:
+    """Stable identifier of a token that doesn't keep the token itself"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def is_token_revoked(digest: str) -> bool:
+    exp = _revoked.get(digest)
+    return exp is not None and exp > time.time()
+
+
+def _remember(digest: str, exp: float) -> None:
+    now = time.time()
+    if exp <= now:
+        return
+    _revoked[digest] = exp
+    # Expired tokens fail verification anyway; drop them so the set stays small
+    if len(_revoked) % 1000 == 0:
+        for expired in [key for key, value in _revoked.items() if value <= now]:
+            del _revoked[expired]
+
+
+async def revoke_token(token: str, exp: float) -> None:
+    """Revoke a token until it expires, in Redis and in every API process"""
+    digest = token_digest(token)
+    _remember(digest, exp)
+
+    client = await get_redis_client()
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.zadd(REVOKED_TOKENS_KEY, {digest: exp})
+        pipe.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", time.time())
+        pipe.publish(REVOCATION_CHANNEL, json.dumps({"digest": digest, "exp": exp}))
+        await pipe.execute()
+
+
+async def fetch_token_revoked(digest: str) -> bool:
+    """Check Redis for a revocation the local mirror may have missed"""
+    client = await get_redis_client()
+    exp = await client.zscore(REVOKED_TOKENS_KEY, digest)
+    if exp is None or exp <= time.time():
+        return False
+    _remember(digest, exp)
+    return True
+
+
+async def load_revoked_tokens() -> None:
+    """Fill the local mirror from Redis"""
+    client = await get_redis_client()
+    for digest, exp in await client.zrangebyscore(REVOKED_TOKENS_KEY, time.time(), "+inf", withscores=True):
+        _remember(digest, exp)
+
+
+async def watch_revocations() -> None:
+    """Keep the local mirror in sync for the lifetime of the process"""
+    # Revocations published while the subscriber was reconnecting are lost; reload them
+    pubsub_hub.add_reconnect_handler(load_revoked_tokens)
+    while True:
+        try:
+            # Subscribe before loading so no revocation falls in between; the
+            # queue is unbounded because a dropped event would un-revoke a token
+            async with pubsub_hub.listen(REVOCATION_CHANNEL, queue_size=0) as events:
+                await load_revoked_tokens()
+                while True:
+                    event = json.loads(await events.get())
+                    _remember(event["digest"], float(event["exp"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Token revocation watcher failed; restarting")
+            await asyncio.sleep(1)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Micro-benchmark of the authenticated request path.
+
+Compares the previous path (full JWT decode and signature check on every
+request) with the current one on a cache hit (decoded-claims cache keyed
+by the token digest, plus the local revocation check). Both resolve the
+user from a warm in-process principal cache, so the numbers show the
+per-request CPU cost of authentication alone. Reports p50/p99 latency and
+throughput.
+
+No Redis or database is needed.
+
+Usage:
+    python scripts/benchmark_auth.py --iterations 100000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Optional
+
+from jose import JWTError, jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.middleware import auth as auth_middleware
+from app.schemas import UserPrincipal
+from app.utils.auth import create_access_token, token_cache, verify_token_async
+from app.utils.cache import principal_cache, user_principal_key
+from app.utils.token_revocation import token_digest
+
+
+async def legacy_verify_token(token: str) -> Optional[dict]:
+    """verify_token before the verification cache"""
+    try:
+        return jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError:
+        return None
+
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+async def measure(verifier, token: str, iterations: int) -> dict:
+    auth_middleware.verify_token_async = verifier
+    timings = []
+    db = AsyncSession()
+    try:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await auth_middleware.authenticate_token(token, db)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+    finally:
+        await db.close()
+    return {
+        "p50": statistics.median(timings),
+        "p99": percentile(timings, 0.99),
+        "per_sec": iterations / (sum(timings) / 1_000_000),
+    }
+
+
+async def run(iterations: int) -> None:
+    principal = UserPrincipal(id=1, mobile_number="9999999999", subscription_tier="pro")
+    principal_cache.local.ttl = 3600
+    principal_cache.set_local(user_principal_key(principal.id), principal)
+    token = create_access_token({"sub": str(principal.id)})
+    # Steady state: the token was verified (and checked against Redis) by an earlier request
+    token_cache.ttl = 3600
+    token_cache.set(token_digest(token), jwt.get_unverified_claims(token))
+
+    # Warm up
+    await measure(legacy_verify_token, token, 1000)
+    await measure(verify_token_async, token, 1000)
+
+    results = {
+        "legacy": await measure(legacy_verify_token, token, iterations),
+        "cached": await measure(verify_token_async, token, iterations),
+    }
+
+    print(f"{'path':<8} {'p50 us':>8} {'p99 us':>8} {'req/s':>10}")
+    for name, result in results.items():
+        print(f"{name:<8} {result['p50']:>8.1f} {result['p99']:>8.1f} {result['per_sec']:>10.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
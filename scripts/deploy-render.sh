@@ -32,7 +32,7 @@ echo "1. Create PostgreSQL database"
 echo "2. Create Redis instance"
 echo "3. Create Web Service from GitHub repo"
 echo "4. Set build command: pip install -r requirements.txt"
-echo "5. Set start command: python -m uvicorn app.main:app --host 0.0.0.0 --port \$PORT"
+echo "5. Set start command: alembic upgrade head && python -m uvicorn app.main:app --host 0.0.0.0 --port \$PORT"
 echo ""
 echo "✅ Follow the instructions above to complete deployment"
 